@@ -21,6 +21,10 @@ if [ ! -d ./reports ]; then
     mkdir reports
 fi
 
+if [ ! -d ./cache ]; then
+    mkdir cache
+fi
+
 DEFAULT_CONFIG=$(cat <<-END
 general:
   debug: ${GENERAL_DEBUG}
@@ -1,10 +1,18 @@
 import datetime
+import threading
 import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 
 def flatten(l):
     return [item for sublist in l for item in sublist]
 
 
+def chunks(l, size):
+    for i in range(0, len(l), size):
+        yield l[i:i + size]
+
+
 def normalize_none(attr):
     if attr is None:
         attr = ""
@@ -65,3 +73,63 @@ class ProgressCounter():
     def deflogger_skip(self):
         pass
 
+
+class KeyedExecutor():
+    """ Thread pool where tasks sharing a key run one after another, in submission order """
+
+    def __init__(self, workers, max_pending=None):
+        super().__init__()
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+        self._queues = {}
+        self._lock = threading.Lock()
+        # block submitters instead of queueing without limit
+        self._pending = threading.BoundedSemaphore(max_pending or workers * 4)
+
+    def submit(self, key, fn, *args, **kwargs):
+        future = Future()
+        # single worker: run inline
+        if not self._executor:
+            self._run(future, fn, args, kwargs)
+            return future
+
+        self._pending.acquire()
+        with self._lock:
+            tasks = self._queues.setdefault(key, deque())
+            tasks.append((future, fn, args, kwargs))
+            # a task with this key is already queued, ours runs after it
+            if len(tasks) > 1:
+                return future
+        self._executor.submit(self._drain, key)
+        return future
+
+    def _run(self, future, fn, args, kwargs):
+        if future.set_running_or_notify_cancel():
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+
+    def _drain(self, key):
+        while True:
+            with self._lock:
+                future, fn, args, kwargs = self._queues[key][0]
+            self._run(future, fn, args, kwargs)
+            self._pending.release()
+            with self._lock:
+                tasks = self._queues[key]
+                tasks.popleft()
+                if not tasks:
+                    del self._queues[key]
+                    return
+
+    def shutdown(self, wait=True):
+        if self._executor:
+            self._executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown(wait=True)
+        return False
@@ -1,5 +1,7 @@
+import codecs
 import json
 import sys
+import threading
 
 import requests
 import urllib3
@@ -7,6 +9,10 @@ import urllib3
 from debugtoolkit.debugtoolkit import deflogger, dry_request, init_logger, measure
 
 
+# status errorCode of a request with an expired or unknown sessionId
+FNT_SESSION_EXPIRED_CODES = ["SESSION_EXPIRED", "INVALID_SESSION"]
+
+
 class FNTNotAuthorized(Exception):
     pass
 
@@ -15,24 +21,85 @@ class FNTException(Exception):
     pass
 
 
+class JSONStream:
+    """ Incremental JSON tokenizer over an iterator of text chunks """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = ""
+        self._pos = 0
+        self._decoder = json.JSONDecoder()
+
+    def _fill(self):
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            return False
+        self._buffer = self._buffer[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def peek(self):
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in " \t\r\n":
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                raise ValueError("Unexpected end of JSON stream")
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f'Expected "{char}" at JSON stream position {self._pos}')
+        self._pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # a number may continue in the next chunk
+            if end == len(self._buffer) and self._fill():
+                continue
+            self._pos = end
+            return value
+
+
 class FNTCommandAPI:
-    def __init__(self, url, username, password):
+    def __init__(self, url, username, password, pool_size=10, timeout=5, session_expired_codes=None):
         super().__init__()
+        self.session_expired_codes = session_expired_codes or FNT_SESSION_EXPIRED_CODES
         self.fnt_api_url = f"{url}/axis/api/rest"
         self.authorized = False
-        self.auth(url, username, password)
+        self.session_id = None
+        self.timeout = timeout
+        self._credentials = (url, username, password)
+        self._auth_lock = threading.Lock()
 
-    def send_request(self, method, payload=None, headers=None, params=None, exit=False):
+        # keep-alive connection pool shared by all requests
         urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.verify = False
+        self.session.headers.update({"Content-Type": "application/json", "Accept": "application/json"})
+
+        self.auth(url, username, password)
+
+    def send_request(self, method, payload=None, headers=None, params=None, exit=False, relogin=True, replay=True):
         fnt_api_endpoint = f"{self.fnt_api_url}/{method}"
-        if not params and self.authorized:
-            params = {"sessionId": self.session_id}
+        session_id = None
+        if params is None and self.authorized:
+            session_id = self.session_id
+            params = {"sessionId": session_id}
 
-        if not headers:
-            headers = {"Content-Type": "application/json", "Accept": "application/json"}
         try:
-            response = requests.post(
-                url=fnt_api_endpoint, data=json.dumps(payload), headers=headers, params=params, timeout=5, verify=False
+            response = self.session.post(
+                url=fnt_api_endpoint, data=json.dumps(payload), headers=headers, params=params, timeout=self.timeout
             )
         except requests.RequestException as e:
             logger.exception(f"Failed to send request ({fnt_api_endpoint=})")
@@ -41,17 +108,46 @@ class FNTCommandAPI:
             else:
                 raise(e)
 
+        # decode once
+        try:
+            response_json = response.json()
+        except ValueError:
+            response_json = None
+        status = response_json.get("status", {}) if isinstance(response_json, dict) else {}
+
+        if response and status.get("success"):
+            return response_json
+
+        # expired session: login again and retry once
+        if relogin and session_id and self.is_session_expired(status):
+            logger.info(f'FNT session expired, logging in again for method "{method}".')
+            try:
+                self.relogin(session_id)
+            except FNTNotAuthorized as e:
+                raise FNTException(f"FNT Exception: session expired and login failed ({e})")
+            # creating twice would duplicate the entity if the first request was executed after all
+            if not replay:
+                raise FNTException(f'FNT Exception: session expired, "{method}" not repeated')
+            return self.send_request(method, payload=payload, headers=headers, exit=exit, relogin=False)
+
         if response:
             # print('response: \n' + response.text)
-            if response.json()["status"]["success"]:
-                return response.json()
-            else:
-                logger.error(f'Failed to execute method "{method}": {response.json()["status"]}')
-                raise FNTException(f'FNT Exception: {response.json()["status"]}')
+            logger.error(f'Failed to execute method "{method}": {status}')
+            raise FNTException(f"FNT Exception: {status}")
         else:
             logger.error(f'Failed to send request for method "{method}": {response}')  # ["status"]}'
             raise FNTException(f"FNT Exception: {response.text}")
 
+    def is_session_expired(self, status):
+        return status.get("errorCode") in self.session_expired_codes
+
+    def relogin(self, stale_session_id):
+        with self._auth_lock:
+            # another thread may have logged in already
+            if self.session_id != stale_session_id:
+                return True
+            return self.auth(*self._credentials)
+
     def auth(self, url, username, password):
         payload = {
             "user": username,
@@ -61,7 +157,7 @@ class FNTCommandAPI:
         }
         method = "businessGateway/login"
         try:
-            response = self.send_request(method=method, payload=payload)
+            response = self.send_request(method=method, payload=payload, params={}, relogin=False)
             if response and response["status"]["success"]:
                 self.session_id = response["sessionId"]
                 self.authorized = True
@@ -76,22 +172,87 @@ class FNTCommandAPI:
     #         logger.warning(f"Not authorized to execute {method} method")
     #         return False
 
-    def get_entities(self, entity_type, entity_custom=False, restrictions={}, attributes=[], last_deleted=False):
+    @staticmethod
+    def get_entities_method(entity_type, entity_custom=False, last_deleted=False):
         if not last_deleted:
             method = 'query'
         else:
             method = 'queryLastDeleted'
 
         if entity_custom:
-            method_uri = f"entity/custom/{entity_type}/{method}"
+            return f"entity/custom/{entity_type}/{method}"
         else:
-            method_uri = f"entity/{entity_type}/{method}"
+            return f"entity/{entity_type}/{method}"
 
+    def get_entities(self, entity_type, entity_custom=False, restrictions={}, attributes=[], last_deleted=False):
+        method_uri = self.get_entities_method(entity_type, entity_custom, last_deleted)
         payload = {"restrictions": restrictions, "returnAttributes": attributes}
 
         response = self.send_request(method=method_uri, payload=payload)
         return response["returnData"]
 
+    def iter_entities(self, entity_type, entity_custom=False, restrictions={}, attributes=[], last_deleted=False):
+        """
+        Same query as get_entities, but yields entities from "returnData" while
+        the response body is being received instead of decoding it at once.
+        Error responses are handed over to send_request (relogin, exceptions).
+        """
+        method_uri = self.get_entities_method(entity_type, entity_custom, last_deleted)
+        payload = {"restrictions": restrictions, "returnAttributes": attributes}
+        fnt_api_endpoint = f"{self.fnt_api_url}/{method_uri}"
+
+        try:
+            response = self.session.post(
+                url=fnt_api_endpoint,
+                data=json.dumps(payload),
+                params={"sessionId": self.session_id},
+                timeout=self.timeout,
+                stream=True,
+            )
+        except requests.RequestException as e:
+            logger.exception(f"Failed to send request ({fnt_api_endpoint=})")
+            raise(e)
+
+        status = None
+        streamed = False
+        with response:
+            if response:
+                decoder = codecs.getincrementaldecoder(response.encoding or "utf-8")()
+                chunks = (decoder.decode(chunk) for chunk in response.iter_content(chunk_size=65536))
+                stream = JSONStream(chunks)
+                try:
+                    stream.expect("{")
+                    while stream.peek() != "}":
+                        key = stream.value()
+                        stream.expect(":")
+                        if key == "returnData" and (status is None or status.get("success")) and stream.peek() == "[":
+                            stream.expect("[")
+                            while stream.peek() != "]":
+                                yield stream.value()
+                                streamed = True
+                                if stream.peek() == ",":
+                                    stream.expect(",")
+                            stream.expect("]")
+                        else:
+                            value = stream.value()
+                            if key == "status":
+                                status = value
+                        if stream.peek() == ",":
+                            stream.expect(",")
+                except ValueError as e:
+                    if streamed:
+                        raise FNTException(f"FNT Exception: invalid response for method {method_uri}: {e}")
+                    status = None
+
+        if status is not None and status.get("success"):
+            return
+        if streamed:
+            logger.error(f'Failed to execute method "{method_uri}": {status}')
+            raise FNTException(f"FNT Exception: {status}")
+
+        # not a successful response, repeat without streaming
+        yield from self.get_entities(entity_type, entity_custom, restrictions, attributes, last_deleted)
+
     def get_related_entities(self, entity_type, entity_elid, relation_type, restrictions={}, attributes=[]):
         method = f"entity/{entity_type}/{entity_elid}/{relation_type}"
         payload = {
@@ -110,17 +271,17 @@ class FNTCommandAPI:
         else:
             method = f"entity/custom/{entity_type}/create"
 
-        response = self.send_request(method=method, payload=payload)
+        response = self.send_request(method=method, payload=payload, replay=False)
         return response["returnData"]
 
-    def update_entity(self, entity_type, entity_elid, entity_custom=False, **attributes):
+    def update_entity(self, entity_type, entity_elid, entity_custom=False, replay=True, **attributes):
         payload = {**attributes}
         if not entity_custom:
             method = f"entity/{entity_type}/{entity_elid}/update"
         else:
             method = f"entity/custom/{entity_type}/{entity_elid}/update"
 
-        response = self.send_request(method=method, payload=payload)
+        response = self.send_request(method=method, payload=payload, replay=replay)
         return response["returnData"]
 
     def delete_entity(self, entity_type, entity_elid, entity_custom=False):
@@ -135,7 +296,7 @@ class FNTCommandAPI:
 
     def create_related_entities(self, entity_type, entity_elid, relation_type, linked_elid):
         attributes = {f"createLink{relation_type}": [{"linkedElid": linked_elid}]}
-        response = self.update_entity(entity_type=entity_type, entity_elid=entity_elid, **attributes)
+        response = self.update_entity(entity_type=entity_type, entity_elid=entity_elid, replay=False, **attributes)
         return response
 
     # #@dryable.Dryable()
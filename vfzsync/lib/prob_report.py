@@ -20,6 +20,7 @@ from .vfzlib import (
     FNT_VS_FILTER_FNT_DELETED_UNCONFIRMED_SERVERS,
     FNT_ZABBIX_FLAG_TRIGGERS
 )
+from .zabbixapi import ZabbixBatchAPI
 from debugtoolkit.debugtoolkit import (
     init_logger,
     crash_me,
@@ -381,19 +382,28 @@ def fnt_zabbix_stats(zapi, command, args):
     #done #foreach
     index = ("id",)
     fnt_virtualservers_new, fnt_virtualservers_new_indexed = get_fnt_vs(
-        command=command, indexes=index, related_entities=False, restrictions=FNT_VS_FILTER_FNT_NEW_SERVERS, datasources=vfzsync.CONFIG["vpoller"]["vc_hosts"]
+        command=command,
+        indexes=index,
+        related_entities=False,
+        restrictions=FNT_VS_FILTER_FNT_NEW_SERVERS,
+        datasources=vfzsync.CONFIG["vpoller"]["vc_hosts"],
+        profile="report",
     )
     fnt_virtualservers_deleted, fnt_virtualservers_deleted_indexed = get_fnt_vs(
         command=command,
         indexes=index,
         related_entities=False,
         restrictions=FNT_VS_FILTER_FNT_DELETED_UNCONFIRMED_SERVERS,
-        datasources=vfzsync.CONFIG["vpoller"]["vc_hosts"]
+        datasources=vfzsync.CONFIG["vpoller"]["vc_hosts"],
+        profile="report",
     )
 
-    stats = {}
-    for tag in FNT_ZABBIX_FLAG_TRIGGERS:
-        stats[tag] = zapi.trigger.get(tags=[{"tag": "FNT_Flag", "value": tag, 'operator': 1}], filter={"value": 1, "status": 0}, monitored=True, countOutput=True, skipDependent=True)
+    # one request for all flag counts
+    with ZabbixBatchAPI(zapi) as batch:
+        stats = {}
+        for tag in FNT_ZABBIX_FLAG_TRIGGERS:
+            stats[tag] = batch.trigger.get(tags=[{"tag": "FNT_Flag", "value": tag, 'operator': 1}], filter={"value": 1, "status": 0}, monitored=True, countOutput=True, skipDependent=True)
+    stats = {tag: stats[tag].result() for tag in stats}
     
     dataframe = pd.DataFrame(
         [
@@ -448,7 +458,12 @@ def fnt_zabbix_servers_table(zapi, command, args):
     index = ("id",)
     if args == "new":
         fnt_virtualservers_new, fnt_virtualservers_new_indexed = get_fnt_vs(
-            command=command, indexes=index, related_entities=False, restrictions=FNT_VS_FILTER_FNT_NEW_SERVERS, datasources=vfzsync.CONFIG["vpoller"]["vc_hosts"]
+            command=command,
+            indexes=index,
+            related_entities=False,
+            restrictions=FNT_VS_FILTER_FNT_NEW_SERVERS,
+            datasources=vfzsync.CONFIG["vpoller"]["vc_hosts"],
+            profile="report",
         )
         # report_vars = {}
         servers = [vs["visibleId"] for vs in fnt_virtualservers_new]
@@ -461,7 +476,8 @@ def fnt_zabbix_servers_table(zapi, command, args):
             indexes=index,
             related_entities=False,
             restrictions=FNT_VS_FILTER_FNT_DELETED_UNCONFIRMED_SERVERS,
-            datasources=vfzsync.CONFIG["vpoller"]["vc_hosts"]
+            datasources=vfzsync.CONFIG["vpoller"]["vc_hosts"],
+            profile="report",
         )
         servers = [vs["visibleId"] for vs in fnt_virtualservers_deleted]
         # report_vars['deleted_servers'] = ', '.join(servers)
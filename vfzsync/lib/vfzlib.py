@@ -7,6 +7,13 @@ import time
 import random
 import uuid
 import glob
+import copy
+import hashlib
+import threading
+import queue
+import fcntl
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 from dateutil import parser
 from pyzabbix.api import ZabbixAPI, ZabbixAPIException
@@ -87,11 +94,21 @@ VPOLLER_VM_ATTRIBUTES = [
     "summary.storage.committed",
     "summary.storage.uncommitted",
     "summary.guest.hostName",
-    "summary.config.guestFullName"
+    "summary.config.guestFullName",
     # "summary.guest.guestFullName"
 ]
 VPOLLER_VM_NET_ATTRIBUTES = ["ipAddress"]
 VPOLLER_VM_DISK_ATTRIBUTES = ["diskPath", "capacity", "freeSpace", "freeSpacePercentage"]
+# guest disks and NICs in one property fetch
+VPOLLER_VM_GUEST_ATTRIBUTES = ["guest.disk", "guest.net"]
+# base properties that change along with guest disks/NICs
+VPOLLER_VM_FINGERPRINT_ATTRIBUTES = [
+    "config.changeVersion",
+    "runtime.powerState",
+    "summary.guest.ipAddress",
+    "summary.guest.hostName",
+    "summary.storage.committed",
+]
 
 VC_HOSTS = [vc for vc in vfzsync.CONFIG["vpoller"]["vc_hosts"] if vc]
 
@@ -147,6 +164,32 @@ FNT_ZABBIX_FLAG_TRIGGERS = [
     "cSdiBackupNeeded",
 ]
 
+# ZabbixChangeset operations sent in chunks across hosts, in execution order
+ZABBIX_BATCH_METHODS = {
+    "item_update": "item.update",
+    "trigger_update": "trigger.update",
+    "hostinterface_update": "hostinterface.update",
+    "host_update": "host.update",
+}
+
+# columns each caller of get_fnt_vs needs
+FNT_VS_PROFILES = {
+    "sync": FNT_VS_ATTRIBUTES,
+    "zabbix": [
+        "id",
+        "visibleId",
+        "elid",
+        "cManagementInterface",
+        "cCommunityName",
+        "cSdiNewServer",
+        "cSdiDeleted",
+        "datasource",
+        "cSdiPurpose",
+    ] + FNT_ZABBIX_FLAG_TRIGGERS,
+    "stats": ["id", "cSdiNewServer", "cSdiDeleted", "cCSdiDelConfirmed"],
+    "report": ["id", "visibleId"],
+}
+
 ZABBIX_MACROS = ["{$SNMP_COMMUNITY}", "{$HOST_PURPOSE}", "{$VSPHERE.HOST}"]
 
 
@@ -154,6 +197,12 @@ class VFZException(Exception):
     pass
 
 
+# shared by all VFZSync instances of the process
+fnt_vs_replica = None
+fnt_vs_replica_lock = threading.Lock()
+zabbix_id_cache = init_zabbix_id_cache(vfzsync.CONFIG["zabbix"].get("id_cache_ttl", 300))
+
+
 def init_tracing():
     if debugtoolkit.TRACE:
         for module in [
@@ -169,180 +218,830 @@ def init_tracing():
                 deflogger_module(sys.modules[module], measure(operation=sum))
 
 
+def log_task_exception(future):
+    if not future.cancelled() and future.exception():
+        e = future.exception()
+        logger.error(f"Task failed: {e}", exc_info=(type(e), e, e.__traceback__))
+
+
 def test_config():
     # print(vfzsync.CONFIG)
     print("test_config")
 
 
-def get_vpoller_vms(vpoller, vcenters):
-    #done #foreach
-    vms = []
-    for vc_host in vcenters:
-        vpoller_resp = vpoller.run(method="vm.discover", vc_host=vc_host)
-        vm_names = [vm["name"] for vm in vpoller_resp]
+def get_cache_path(name):
+    cache_dir = vfzsync.CONFIG["general"].get("cache_dir", "cache")
+    os.makedirs(cache_dir, exist_ok=True)
+    return f"{cache_dir}/{name}"
 
-        # progress counter
-        counter = ProgressCounter(len(vm_names), 10, 60)
 
-        for vm_name in vm_names:
-            progress = counter.iterate()
-            if progress:
-                logger.info(f"{sys._getframe().f_code.co_name} progress: {counter.progress}%")
+def load_cache(path):
+    try:
+        with open(path, mode="r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError):
+        logger.exception(f"Failed to load cache {path}, starting empty.")
+    return {}
+
+
+def save_cache(path, data):
+    try:
+        with open(f"{path}.tmp", mode="w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(f"{path}.tmp", path)
+    except OSError:
+        logger.exception(f"Failed to save cache {path}.")
+
+
+class VPollerVMCache:
+    """ Last collected guest disks/NICs per (vc_host, instanceUuid) """
+
+    def __init__(self, path, full_refresh):
+        super().__init__()
+        self.path = path
+        self.full_refresh = full_refresh
+        self.hits = 0
+        self.misses = 0
+        self._seen = set()
+        self._lock = threading.Lock()
+        self._entries = load_cache(path)
+
+    @staticmethod
+    def key(vc_host, vm):
+        return f'{vc_host}/{vm["config.instanceUuid"]}'
+
+    @staticmethod
+    def fingerprint(vm):
+        values = json.dumps([vm.get(attr) for attr in VPOLLER_VM_FINGERPRINT_ATTRIBUTES])
+        return hashlib.md5(values.encode()).hexdigest()
+
+    def get(self, vc_host, vm):
+        key = self.key(vc_host, vm)
+        entry = self._entries.get(key)
+        hit = (
+            entry is not None
+            and entry["fingerprint"] == self.fingerprint(vm)
+            and time.time() - entry["refreshed"] < self.full_refresh
+        )
+        with self._lock:
+            self._seen.add(key)
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if hit:
+            return copy.deepcopy(entry["mountpoint"]), list(entry["ipAddress"])
+        return None
+
+    def put(self, vc_host, vm, disks_indexed, ips):
+        key = self.key(vc_host, vm)
+        entry = {
+            "fingerprint": self.fingerprint(vm),
+            "refreshed": time.time(),
+            "mountpoint": copy.deepcopy(disks_indexed),
+            "ipAddress": list(ips),
+        }
+        with self._lock:
+            self._seen.add(key)
+            self._entries[key] = entry
+
+    def save(self, keep_vcenters=()):
+        # forget VMs not seen this run, unless their vCenter was not fully collected
+        entries = {
+            key: entry
+            for key, entry in self._entries.items()
+            if key in self._seen or key.split("/")[0] in keep_vcenters
+        }
+        save_cache(self.path, entries)
+
+
+class FNTEntityDigests:
+    """ Digest of the linked entities last written to FNT per virtual server elid """
+
+    def __init__(self, path, full_refresh):
+        super().__init__()
+        self.path = path
+        self.full_refresh = full_refresh
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = load_cache(path)
+
+    @staticmethod
+    def digest(vm):
+        # entity values as plan_fnt_vs_entities writes them
+        entities = {
+            "ipAddress": sorted(vm.get("ipAddress", {})),
+            "mountpoint": sorted(
+                [key, gib_round(disk["capacity"]), gib_round(disk["capacity"] - disk["freeSpace"])]
+                for key, disk in vm.get("mountpoint", {}).items()
+            ),
+        }
+        return hashlib.md5(json.dumps(entities).encode()).hexdigest()
+
+    def unchanged(self, vs_elid, digest):
+        entry = self._entries.get(vs_elid)
+        hit = (
+            entry is not None
+            and entry["digest"] == digest
+            and time.time() - entry["written"] < self.full_refresh
+        )
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return hit
+
+    def put(self, vs_elid, digest):
+        with self._lock:
+            self._entries[vs_elid] = {"digest": digest, "written": time.time()}
+
+    def drop(self, vs_elid):
+        with self._lock:
+            self._entries.pop(vs_elid, None)
 
+    def save(self):
+        save_cache(self.path, dict(self._entries))
+
+
+def get_vpoller_vm_guest(vm):
+    """ Guest disks/NICs from a single vm.get, None if vPoller returned them unusable """
+    guest_disks = vm.pop("guest.disk", None)
+    guest_nets = vm.pop("guest.net", None)
+    if not isinstance(guest_disks, list) or not isinstance(guest_nets, list):
+        return None
+
+    try:
+        disks_indexed = {}
+        for guest_disk in guest_disks:
+            capacity = guest_disk["capacity"]
+            free_space = guest_disk["freeSpace"]
+            disks_indexed[guest_disk["diskPath"]] = {
+                "diskPath": guest_disk["diskPath"],
+                "capacity": capacity,
+                "freeSpace": free_space,
+                "freeSpacePercentage": round(100 * free_space / capacity, 2) if capacity else 0,
+            }
+        ips = flatten([net.get("ipAddress") or [] for net in guest_nets])
+    except (KeyError, TypeError, AttributeError):
+        return None
+
+    return disks_indexed, ips
+
+
+def get_vpoller_vm_attributes(cache=None):
+    # fingerprint properties are only needed by the cache
+    if cache is None:
+        return VPOLLER_VM_ATTRIBUTES
+    return VPOLLER_VM_ATTRIBUTES + [
+        attr for attr in VPOLLER_VM_FINGERPRINT_ATTRIBUTES if attr not in VPOLLER_VM_ATTRIBUTES
+    ]
+
+
+def get_vpoller_vm(vpoller, vc_host, vm_name, vm=None, cache=None):
+    guest_data = vfzsync.CONFIG["vpoller"].get("guest_data", "perdisk")
+    # guest data rides along with the base properties unless the cache may serve it
+    guest_inline = guest_data == "single" and vm is None and cache is None
+    guest = None
+
+    # base properties are already known in bulk discovery mode
+    if vm is None:
+        properties = get_vpoller_vm_attributes(cache)
+        if guest_inline:
             try:
                 vm = vpoller.run(
                     method="vm.get",
                     vc_host=vc_host,
                     name=vm_name,
-                    properties=VPOLLER_VM_ATTRIBUTES,
+                    properties=properties + VPOLLER_VM_GUEST_ATTRIBUTES,
                 )[0]
+            except vPollerException as e:
+                logger.debug(f"VM {vm_name}: guest data request failed ({e}), retrying without it.")
+            else:
+                guest = get_vpoller_vm_guest(vm)
+        if vm is None:
+            vm = vpoller.run(
+                method="vm.get",
+                vc_host=vc_host,
+                name=vm_name,
+                properties=properties,
+            )[0]
+
+    cached = False
+    if cache is not None:
+        guest = cache.get(vc_host, vm)
+        cached = guest is not None
+
+    if guest is None and guest_data == "single" and not guest_inline:
+        try:
+            vm_guest = vpoller.run(
+                method="vm.get",
+                vc_host=vc_host,
+                name=vm_name,
+                properties=VPOLLER_VM_GUEST_ATTRIBUTES,
+            )[0]
+        except vPollerException as e:
+            logger.debug(f"VM {vm_name}: guest data request failed ({e}).")
+        else:
+            guest = get_vpoller_vm_guest(vm_guest)
 
-                nets = vpoller.run(
-                    method="vm.guest.net.get",
-                    vc_host=vc_host,
-                    name=vm_name,
-                    properties=VPOLLER_VM_NET_ATTRIBUTES,
-                )
+    if guest is not None:
+        disks_indexed, ips = guest
+    else:
+        if guest_data == "single":
+            logger.debug(f"VM {vm_name}: guest data not usable, falling back to per-disk collection.")
+
+        nets = vpoller.run(
+            method="vm.guest.net.get",
+            vc_host=vc_host,
+            name=vm_name,
+            properties=VPOLLER_VM_NET_ATTRIBUTES,
+        )
 
-                disks_discovery = vpoller.run(
-                    method="vm.disk.discover", vc_host=vc_host, name=vm_name
-                )
+        disks_discovery = vpoller.run(
+            method="vm.disk.discover", vc_host=vc_host, name=vm_name
+        )
 
-                disks_indexed = {}
-                for disk_obj in disks_discovery[0]["disk"]:
-                    disk = vpoller.run(
-                        method="vm.disk.get",
-                        vc_host=vc_host,
-                        name=vm_name,
-                        key=disk_obj["diskPath"],
-                        properties=VPOLLER_VM_DISK_ATTRIBUTES,
-                    )[0]["disk"]
-                    disks_indexed[disk_obj["diskPath"]] = disk
-                # disks_indexed = {disk['diskPath']:disk for disk in disks}
-                ips = flatten([net["ipAddress"] for net in nets["net"]])
-                ips_v4 = [ip for ip in ips if re.match(r"(\d+\.){3}\d+", ip)]
-                ips_indexed = {ip: {"ipAddress": ip} for ip in ips_v4}
-                vm["ipAddress"] = ips_indexed
-                vm["mountpoint"] = disks_indexed
-                vm["summary.storage.provisioned"] = (
-                    vm["summary.storage.committed"] + vm["summary.storage.uncommitted"]
-                )
-                (vm["summary.storage.committed.gb"], vm["summary.storage.provisioned.gb"],) = list(
-                    map(gib_round, [vm["summary.storage.committed"], vm["summary.storage.provisioned"]])
-                )
-                vm["vc_host"] = vc_host
+        disks_indexed = {}
+        for disk_obj in disks_discovery[0]["disk"]:
+            disk = vpoller.run(
+                method="vm.disk.get",
+                vc_host=vc_host,
+                name=vm_name,
+                key=disk_obj["diskPath"],
+                properties=VPOLLER_VM_DISK_ATTRIBUTES,
+            )[0]["disk"]
+            disks_indexed[disk_obj["diskPath"]] = disk
+        ips = flatten([net["ipAddress"] for net in nets["net"]])
+
+    if cache is not None and not cached:
+        cache.put(vc_host, vm, disks_indexed, ips)
+
+    # disks_indexed = {disk['diskPath']:disk for disk in disks}
+    ips_v4 = [ip for ip in ips if re.match(r"(\d+\.){3}\d+", ip)]
+    ips_indexed = {ip: {"ipAddress": ip} for ip in ips_v4}
+    vm["ipAddress"] = ips_indexed
+    vm["mountpoint"] = disks_indexed
+    vm["summary.storage.provisioned"] = (
+        vm["summary.storage.committed"] + vm["summary.storage.uncommitted"]
+    )
+    (vm["summary.storage.committed.gb"], vm["summary.storage.provisioned.gb"],) = list(
+        map(gib_round, [vm["summary.storage.committed"], vm["summary.storage.provisioned"]])
+    )
+    vm["vc_host"] = vc_host
+    return vm
 
-                vms.append(vm)
 
-            except vPollerException:
-                logger.exception(f"Failed to get VM {vm_name} properties.")
-                raise VFZException("Failed to get VM data from vPoller")
+def get_vpoller_vc_vms(vpoller, vc_host, emit, cache=None):
+    """ Collect VMs of one vCenter within its time budget, passing each one to emit; returns status """
+    workers = vfzsync.CONFIG["vpoller"].get("workers", 1)
+    discovery = vfzsync.CONFIG["vpoller"].get("discovery", "pervm")
+    vc_timeout = vfzsync.CONFIG["vpoller"].get("vc_timeout") or None
+    started = time.time()
+    status = {"complete": False, "vms": 0, "elapsed": 0, "error": None}
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        if discovery == "bulk":
+            # one request per vCenter for all base properties
+            vpoller_resp = vpoller.run(method="vm.discover", vc_host=vc_host, properties=get_vpoller_vm_attributes(cache))
+            base_vms = vpoller_resp
+        else:
+            vpoller_resp = vpoller.run(method="vm.discover", vc_host=vc_host)
+            base_vms = [None] * len(vpoller_resp)
+        vm_names = [vm["name"] for vm in vpoller_resp]
+
+        # progress counter
+        counter = ProgressCounter(len(vm_names), 10, 60)
+
+        # a bounded window of VMs in flight, so collected VMs wait in the stream, not in futures
+        window = max(workers, 1) * 2
+        pending = {}
+        next_index = 0
+        # time blocked on a slow consumer does not count against the vCenter budget
+        blocked = 0
+        try:
+            while True:
+                while len(pending) < window and next_index < len(vm_names):
+                    future = executor.submit(get_vpoller_vm, vpoller, vc_host, vm_names[next_index], base_vms[next_index], cache)
+                    pending[future] = next_index
+                    base_vms[next_index] = None
+                    next_index += 1
+                if not pending:
+                    break
+
+                remaining = vc_timeout - (time.time() - started - blocked) if vc_timeout else None
+                finished = set()
+                if remaining is None or remaining > 0:
+                    finished, _ = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+                if not finished:
+                    raise VFZException(f"vCenter {vc_host} collection exceeded {vc_timeout} s")
+
+                for future in finished:
+                    i = pending.pop(future)
+                    progress = counter.iterate()
+                    if progress:
+                        logger.info(f"{sys._getframe().f_code.co_name} {vc_host} progress: {counter.progress}%")
+
+                    try:
+                        vm = future.result()
+                    except vPollerException:
+                        logger.exception(f"Failed to get VM {vm_names[i]} properties.")
+                        raise VFZException(f"Failed to get VM data from vPoller ({vc_host})")
+                    emit_started = time.time()
+                    emit(vm)
+                    blocked += time.time() - emit_started
+                    status["vms"] += 1
+        finally:
+            # keep what was emitted, drop the queued VMs
+            for future in pending:
+                future.cancel()
+
+    except (vPollerException, VFZException) as e:
+        status["error"] = str(e)
+        logger.error(f"vCenter {vc_host} collection incomplete: {e}")
+    else:
+        status["complete"] = True
+    finally:
+        # queued VMs are cancelled, a running request ends within its timeout * retries
+        executor.shutdown(wait=True)
+
+    status["elapsed"] = round(time.time() - started, 1)
+    return status
+
 
+def iter_vpoller_vms(vpoller, vcenters, vcenters_status):
+    """ Yield VMs as they are collected, vcenters_status is filled in as vCenters finish """
+    if not vcenters:
+        return
+
+    cache = None
+    config_cache = vfzsync.CONFIG["vpoller"].get("cache", {})
+    if config_cache.get("enabled"):
+        cache = VPollerVMCache(get_cache_path("vpoller_vms.json"), config_cache.get("full_refresh", 21600))
+
+    # bounded buffer between the collectors and the consumer
+    stream = queue.Queue(maxsize=vfzsync.CONFIG["vpoller"].get("stream_buffer", 100))
+    cancelled = threading.Event()
+    done = object()
+
+    def emit(vm):
+        while not cancelled.is_set():
+            try:
+                stream.put(vm, timeout=1)
+                return
+            except queue.Full:
+                continue
+        raise VFZException("VM stream closed by consumer")
+
+    def collect(vc_host):
+        try:
+            vcenters_status[vc_host] = get_vpoller_vc_vms(vpoller, vc_host, emit, cache)
+            logger.info(f"vCenter {vc_host} collection status: {vcenters_status[vc_host]}")
+        except Exception as e:
+            vcenters_status[vc_host] = {"complete": False, "error": str(e)}
+            logger.exception(f"vCenter {vc_host} collection failed.")
+        finally:
+            try:
+                emit(done)
+            except VFZException:
+                pass
+
+    # vCenters are collected in parallel, each one failing on its own
+    executor = ThreadPoolExecutor(max_workers=len(vcenters))
+    try:
+        for vc_host in vcenters:
+            executor.submit(collect, vc_host)
+        running = len(vcenters)
+        while running:
+            vm = stream.get()
+            if vm is done:
+                running -= 1
+                continue
+            yield vm
+    finally:
+        # unblock collectors if the consumer stopped early
+        cancelled.set()
+        executor.shutdown(wait=True)
+
+    if cache is not None:
+        logger.info(f"vPoller cache: {cache.hits} hits, {cache.misses} misses.")
+        cache.save(keep_vcenters=[vc_host for vc_host in vcenters if not vcenters_status.get(vc_host, {}).get("complete")])
+
+
+def get_vpoller_vms(vpoller, vcenters):
+    #done #foreach
+    vcenters_status = {}
+    vms = list(iter_vpoller_vms(vpoller, vcenters, vcenters_status))
     vms_indexed = {(vm["vc_host"], vm["config.instanceUuid"]): vm for vm in vms}
-    return vms, vms_indexed
+    return vms, vms_indexed, vcenters_status
 
 
 #%%
-def get_fnt_vs(command, indexes, datasources, restrictions={}, related_entities=False):
-    #done #foreach
-    virtualservers = []
-    virtualservers_indexed = {}
-    for vc_host in datasources:
+def query_fnt_vs(command, datasources, restrictions={}, attributes=FNT_VS_ATTRIBUTES):
+    return list(iter_fnt_vs(command, datasources, restrictions, attributes=attributes))
+
+
+def iter_fnt_vs(command, datasources, restrictions={}, attributes=FNT_VS_ATTRIBUTES):
+    """ Yields virtual servers while the FNT response is being decoded """
+    datasources = [vc_host for vc_host in datasources if vc_host]
+
+    # all datasources in one request, only where FNT is known to handle the "in" operator
+    if len(datasources) > 1 and vfzsync.CONFIG["command"].get("multi_datasource_query", False):
+        restrictions_ds = restrictions.copy()
+        restrictions_ds["datasource"] = {"operator": "in", "value": datasources}
+        if "datasource" not in attributes:
+            attributes = attributes + ["datasource"]
+        streamed = False
+        try:
+            for vs in command.iter_entities("virtualServer", attributes=attributes, restrictions=restrictions_ds):
+                streamed = True
+                # in case the restriction was ignored
+                if vs.get("datasource") in datasources:
+                    yield vs
+        except FNTException:
+            if streamed:
+                raise
+            logger.warning("FNT multi-datasource query failed, querying datasources separately.")
+        else:
+            return
+
+    def query_datasource(vc_host):
         restrictions_ds = restrictions.copy()
         restrictions_ds["datasource"] = {"operator": "=", "value": vc_host}
-        virtualservers += command.get_entities(
-            "virtualServer", attributes=FNT_VS_ATTRIBUTES, restrictions=restrictions_ds
+        return list(command.iter_entities("virtualServer", attributes=attributes, restrictions=restrictions_ds))
+
+    workers = min(len(datasources), vfzsync.CONFIG["command"].get("read_workers", 8))
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        for virtualservers_ds in executor.map(query_datasource, datasources):
+            yield from virtualservers_ds
+
+
+def match_fnt_restrictions(entity, restrictions):
+    for attr, restriction in restrictions.items():
+        value = str(normalize_none(entity.get(attr)))
+        expected = str(restriction["value"])
+        if restriction["operator"] == "like":
+            # FNT "like": case-insensitive, * matches any characters
+            pattern = ".*".join(re.escape(part) for part in expected.split("*"))
+            if not re.fullmatch(pattern, value, flags=re.IGNORECASE | re.DOTALL):
+                return False
+        elif restriction["operator"] == "=":
+            if value != expected:
+                return False
+        elif restriction["operator"] == "in":
+            if value not in [str(expected_value) for expected_value in restriction["value"]]:
+                return False
+        else:
+            raise VFZException(f'Unsupported restriction operator {restriction["operator"]}')
+    return True
+
+
+class FNTVirtualServerReplica:
+    """
+    Local copy of FNT virtual servers, refreshed with the ones modified
+    since the last checkpoint plus queryLastDeleted, and fully reloaded
+    every full_resync seconds to repair drift. A refresh is reused for
+    `reuse` seconds unless FNT was written meanwhile, and every
+    verify_interval seconds it is checked against the elids and modification
+    times on the server, a mismatch triggers a full reload.
+    """
+
+    def __init__(self, path, modified_attribute, full_resync, reuse=60, verify_interval=3600, overlap=60):
+        super().__init__()
+        self.path = path
+        self.modified_attribute = modified_attribute
+        self.full_resync = full_resync
+        self.reuse = reuse
+        self.verify_interval = verify_interval
+        self.overlap = overlap
+        self.refreshed = 0
+        self.written = 0
+        self._lock = threading.Lock()
+        state = load_cache(path)
+        self.checkpoint = state.get("checkpoint")
+        self.full_sync = state.get("full_sync", 0)
+        self.verified = state.get("verified", 0)
+        self.datasources = state.get("datasources", [])
+        self.virtualservers = state.get("virtualservers", {})
+
+    def expire(self):
+        """ Next query refreshes, called after writes to FNT """
+        self.written = time.time()
+
+    def refresh(self, command, datasources):
+        started = time.time()
+        datasources = sorted(vc_host for vc_host in datasources if vc_host)
+        if (
+            self.written < self.refreshed
+            and started - self.refreshed < self.reuse
+            and set(datasources) <= set(self.datasources)
+        ):
+            return
+        full = (
+            not self.checkpoint
+            or started - self.full_sync > self.full_resync
+            or not set(datasources) <= set(self.datasources)
         )
-    for vs in virtualservers:
+        if not full:
+            try:
+                restrictions = {self.modified_attribute: {"operator": ">", "value": self.checkpoint}}
+                changed = query_fnt_vs(command, datasources, restrictions, attributes=self.attributes)
+                deleted = command.get_entities("virtualServer", attributes=["elid"], last_deleted=True)
+            except FNTException:
+                logger.warning("FNT delta query failed, falling back to full resync.")
+                full = True
+            else:
+                for vs in changed:
+                    self.virtualservers[vs["elid"]] = vs
+                for vs in deleted:
+                    self.virtualservers.pop(vs.get("elid"), None)
+                logger.debug(f"FNT replica: {len(changed)} changed, {len(deleted)} deleted since {self.checkpoint}.")
+                if started - self.verified > self.verify_interval:
+                    full = not self.verify(command, datasources)
+                    self.verified = started
+
+        if full:
+            self.virtualservers = {vs["elid"]: vs for vs in query_fnt_vs(command, datasources, attributes=self.attributes)}
+            self.full_sync = started
+            self.verified = started
+            self.datasources = datasources
+            logger.info(f"FNT replica: full resync, {len(self.virtualservers)} virtual servers.")
+
+        # overlap the next delta window to tolerate clock skew
+        self.checkpoint = time.strftime("%Y-%m-%dT%H:%M:%S%z", time.localtime(started - self.overlap))
+        self.refreshed = started
+        save_cache(
+            self.path,
+            {
+                "checkpoint": self.checkpoint,
+                "full_sync": self.full_sync,
+                "verified": self.verified,
+                "datasources": self.datasources,
+                "virtualservers": self.virtualservers,
+            },
+        )
+
+    @property
+    def attributes(self):
+        if self.modified_attribute in FNT_VS_ATTRIBUTES:
+            return FNT_VS_ATTRIBUTES
+        return FNT_VS_ATTRIBUTES + [self.modified_attribute]
+
+    def verify(self, command, datasources):
+        """ Compares elids and modification times with the server, False on any difference """
+        try:
+            server = {
+                vs["elid"]: vs.get(self.modified_attribute)
+                for vs in query_fnt_vs(command, datasources, attributes=["elid", self.modified_attribute])
+            }
+        except FNTException:
+            logger.warning("FNT replica check failed, falling back to full resync.")
+            return False
+        replica = {
+            elid: vs.get(self.modified_attribute)
+            for elid, vs in self.virtualservers.items()
+            if vs.get("datasource") in datasources
+        }
+        if server != replica:
+            missing = server.keys() - replica.keys()
+            stale = replica.keys() - server.keys()
+            changed = sum(1 for elid in server.keys() & replica.keys() if server[elid] != replica[elid])
+            logger.warning(
+                f"FNT replica out of sync ({len(missing)} missing, {len(stale)} deleted, {changed} changed), "
+                "falling back to full resync."
+            )
+            return False
+        return True
+
+    def query(self, command, datasources, restrictions={}, attributes=FNT_VS_ATTRIBUTES):
+        with self._lock:
+            self.refresh(command, datasources)
+            # copies, callers add linked entities and normalize attributes
+            return [
+                {attr: vs.get(attr) for attr in attributes}
+                for vs in self.virtualservers.values()
+                if vs.get("datasource") in datasources and match_fnt_restrictions(vs, restrictions)
+            ]
+
+
+def get_fnt_vs_replica():
+    global fnt_vs_replica
+    config_replica = vfzsync.CONFIG["command"].get("replica", {})
+    if not config_replica.get("enabled"):
+        return None
+    with fnt_vs_replica_lock:
+        if fnt_vs_replica is None:
+            fnt_vs_replica = FNTVirtualServerReplica(
+                get_cache_path("fnt_vs_replica.json"),
+                modified_attribute=config_replica.get("modified_attribute", "lastUpdate"),
+                full_resync=config_replica.get("full_resync", 86400),
+                reuse=config_replica.get("reuse", 60),
+                verify_interval=config_replica.get("verify_interval", 3600),
+            )
+    return fnt_vs_replica
+
+
+def expire_fnt_vs_replica():
+    if fnt_vs_replica is not None:
+        fnt_vs_replica.expire()
+
+
+def get_fnt_vs(command, indexes, datasources, restrictions={}, related_entities=False, profile="sync"):
+    #done #foreach
+    virtualservers_indexed = {}
+    attributes = FNT_VS_PROFILES[profile]
+    replica = get_fnt_vs_replica()
+    if replica is not None:
+        virtualservers_iter = replica.query(command, datasources, restrictions, attributes=attributes)
+    else:
+        virtualservers_iter = iter_fnt_vs(command, datasources, restrictions, attributes=attributes)
+    # index while the response is decoded
+    virtualservers = []
+    for vs in virtualservers_iter:
+        virtualservers.append(vs)
         vs_index = tuple(vs[index] for index in indexes)
         virtualservers_indexed[vs_index] = vs
 
     # get linked entities
     if related_entities:
-        for vs in virtualservers:
-            for entity_class_name in FNT_VS_LINKED_ENTITIES:
-                relation_class_name = FNT_VS_LINKED_ENTITIES[entity_class_name]["relation_class_name_plural"]
-                entities = command.get_related_entities(
-                    "virtualServer", entity_elid=vs["elid"], relation_type=relation_class_name
-                )
-                index = FNT_VS_LINKED_ENTITIES[entity_class_name]["index"]
-                entities_indexed = {entity["entity"][index]: entity for entity in entities}
-                vs[entity_class_name] = entities_indexed
+        load_fnt_vs_entities(command, virtualservers)
 
     return virtualservers, virtualservers_indexed
 
 
-def sync_fnt_vs(command, vpoller_vms, fnt_virtualservers_indexed):
-    #done #foreach
-    # progress counter
-    counter = ProgressCounter(len(vpoller_vms), 25, 60)
+def get_fnt_vs_entities(command, vs):
+    for entity_class_name in FNT_VS_LINKED_ENTITIES:
+        relation_class_name = FNT_VS_LINKED_ENTITIES[entity_class_name]["relation_class_name_plural"]
+        entities = command.get_related_entities(
+            "virtualServer", entity_elid=vs["elid"], relation_type=relation_class_name
+        )
+        index = FNT_VS_LINKED_ENTITIES[entity_class_name]["index"]
+        entities_indexed = {entity["entity"][index]: entity for entity in entities}
+        vs[entity_class_name] = entities_indexed
+    return vs
+
+
+class FNTChangeset:
+    """ Planned vPoller -> FNT writes, in execution order per virtual server """
+
+    OPERATIONS = (
+        "vs_create",
+        "vs_update",
+        "vs_undelete",
+        "entity_create",
+        "entity_update",
+        "entity_delete",
+        "vs_soft_delete",
+        "vs_delete",
+    )
 
-    # create/update vs
-    for vm in vpoller_vms:
-        progress = counter.iterate()
-        if progress:
-            logger.info(f"{sys._getframe().f_code.co_name} progress: {counter.progress}%")
+    def __init__(self):
+        super().__init__()
+        self.operations = []
+        # vs elid -> linked entities digest to store once applied, None to drop it
+        self.digests = {}
+        self._lock = threading.Lock()
+
+    def add(self, operation, key, name, **fields):
+        with self._lock:
+            self.operations.append({"operation": operation, "key": list(key), "name": name, **fields})
+
+    def merge(self, changeset):
+        with self._lock:
+            self.operations += changeset.operations
+            self.digests.update(changeset.digests)
+
+    def grouped(self):
+        groups = {}
+        for operation in self.operations:
+            groups.setdefault(tuple(operation["key"]), []).append(operation)
+        return groups
+
+    def counts(self):
+        counts = {operation: 0 for operation in self.OPERATIONS}
+        for operation in self.operations:
+            counts[operation["operation"]] += 1
+        return counts
+
+    def log_counts(self, title):
+        counts = ", ".join(f"{operation}={count}" for operation, count in self.counts().items())
+        logger.info(f"{title}: {counts}.")
+
+    def to_json(self):
+        return {"counts": self.counts(), "operations": self.operations}
+
+
+def load_fnt_vs_entities(command, virtualservers):
+    # the API has no bulk relation query, so fetch concurrently
+    workers = vfzsync.CONFIG["command"].get("read_workers", 8)
+    if len(virtualservers) <= 1 or workers <= 1:
+        for vs in virtualservers:
+            get_fnt_vs_entities(command, vs)
+        return
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for _ in executor.map(lambda vs: get_fnt_vs_entities(command, vs), virtualservers):
+            pass
 
-        vm_uuid = vm["config.instanceUuid"]
-        vm_vc_host = vm["vc_host"]
-        vm_annotation = vm.get("config.annotation", "")   # may be missing for unknown reason
 
+def plan_fnt_vs_sync(command, vpoller_vms, fnt_virtualservers_indexed, digests=None, changeset=None):
+    #done #foreach
+    if changeset is None:
+        changeset = FNTChangeset()
+
+    planned = []
+    for vm in vpoller_vms:
         # do we have a matching vs?
-        vm_index = (vm_vc_host, vm_uuid)
+        vm_index = (vm["vc_host"], vm["config.instanceUuid"])
         vs = fnt_virtualservers_indexed.get(vm_index, {})
+        entities = True
+        digest = None
+        if vs and digests is not None:
+            # linked entities only if the vm disks/ips differ from what was last written
+            digest = digests.digest(vm)
+            entities = not digests.unchanged(vs["elid"], digest)
+        planned.append((vm, vs, entities, digest))
+
+    if digests is not None:
+        load_fnt_vs_entities(command, [vs for vm, vs, entities, digest in planned if vs and entities])
+
+    for vm, vs, entities, digest in planned:
+        try:
+            plan_fnt_vs_vm(changeset, vm, vs, entities=entities)
+        except Exception:
+            logger.exception(f'VirtualServer {vm.get("name")}: Failed to plan sync.')
+            continue
+        # only a planned vs may be recorded as written
+        if digest is not None and entities:
+            changeset.digests[vs["elid"]] = digest
+
+    return changeset
+
+
+def plan_fnt_vs_vm(changeset, vm, vs, entities=True):
+    vm_annotation = vm.get("config.annotation", "")   # may be missing for unknown reason
+    vm_index = (vm["vc_host"], vm["config.instanceUuid"])
+    vs_attr_updateset = {}
+
+    # populate extra vm attributes
+    # vm["last_backup"] = "1970-01-01T00:00:00Z"  # default backup date
+    vm["last_backup"] = None
+    if m := re.match(r".*(Last backup|Time): \[(\d\d\.\d\d\.\d\d\d\d .*?)\].*", vm_annotation):  # noqa
+        last_backup = m.group(2)
+        last_backup = re.sub(
+            r"(\d{1,2})\.(\d{1,2})\.(\d{4}) (\d{1,2}:\d{1,2}:\d{1,2})",
+            f'\\3-\\2-\\1T\\4{( time.strftime("%z", time.localtime() ) )}',
+            last_backup,
+        )
+        # validate date
+        last_backup = parser.parse(last_backup).strftime("%Y-%m-%dT%H:%M:%S%z")
+        vm["last_backup"] = last_backup
+        if vs.get("cSdiLastBackup"):
+            last_backup_local = datetime_to_local_timezone(parser.parse(vs["cSdiLastBackup"])).strftime(
+                "%Y-%m-%dT%H:%M:%S%z"
+            )
+            vs["cSdiLastBackup"] = last_backup_local
 
-        vs_attr_updateset = {}
+    # compare and update attributes
+    for tm_entry in VPOLLER_FNT_TRANSFORM_MAP:
+        vm_attr, vs_attr = tm_entry
+        if normalize_none(vm.get(vm_attr, "")) != normalize_none(vs.get(vs_attr)):
+            # vs_attr_updateset[vs_attr] = normalize_none(vm.get(vm_attr, ""))
+            vs_attr_updateset[vs_attr] = vm.get(vm_attr, None)
 
-        # populate extra vm attributes
-        # vm["last_backup"] = "1970-01-01T00:00:00Z"  # default backup date
-        vm["last_backup"] = None
-        if m := re.match(r".*(Last backup|Time): \[(\d\d\.\d\d\.\d\d\d\d .*?)\].*", vm_annotation):  # noqa
-            last_backup = m.group(2)
-            last_backup = re.sub(
-                r"(\d{1,2})\.(\d{1,2})\.(\d{4}) (\d{1,2}:\d{1,2}:\d{1,2})",
-                f'\\3-\\2-\\1T\\4{( time.strftime("%z", time.localtime() ) )}',
-                last_backup,
-            )
-            # validate date
-            last_backup = parser.parse(last_backup).strftime("%Y-%m-%dT%H:%M:%S%z")
-            vm["last_backup"] = last_backup
-            if vs.get("cSdiLastBackup"):
-                last_backup_local = datetime_to_local_timezone(parser.parse(vs["cSdiLastBackup"])).strftime(
-                    "%Y-%m-%dT%H:%M:%S%z"
-                )
-                vs["cSdiLastBackup"] = last_backup_local
-
-        # compare and update attributes
-        for tm_entry in VPOLLER_FNT_TRANSFORM_MAP:
-            vm_attr, vs_attr = tm_entry
-            if normalize_none(vm.get(vm_attr, "")) != normalize_none(vs.get(vs_attr)):
-                # vs_attr_updateset[vs_attr] = normalize_none(vm.get(vm_attr, ""))
-                vs_attr_updateset[vs_attr] = vm.get(vm_attr, None)
-
-        if vs:
-            # undelete vs if discovered again
-            if yes_no(vs["cSdiDeleted"]):
-                if yes_no(vs["cCSdiDelConfirmed"]):
-                    vs_attr_updateset["cSdiNewServer"] = "Y"
-                vs_attr_updateset["cSdiDeleted"] = "N"
-                vs_attr_updateset["cCSdiDelConfirmed"] = "N"
-
-            # update linked entities
-            sync_fnt_vs_entities(command, vs=vs, vm=vm, vs_attr_updateset=vs_attr_updateset)
-
-        # do we have attributes to create/update
+    if not vs:
         if vs_attr_updateset:
-            create_update_fnt_vs(command, vs=vs, vs_attr_updateset=vs_attr_updateset)
+            vs_attr_updateset["cSdiNewServer"] = "Y"
+            changeset.add("vs_create", vm_index, vs_attr_updateset.get("visibleId"), attributes=vs_attr_updateset)
+        return
+
+    operation = "vs_update"
+    # undelete vs if discovered again
+    if yes_no(vs["cSdiDeleted"]):
+        if yes_no(vs["cCSdiDelConfirmed"]):
+            vs_attr_updateset["cSdiNewServer"] = "Y"
+        vs_attr_updateset["cSdiDeleted"] = "N"
+        vs_attr_updateset["cCSdiDelConfirmed"] = "N"
+        operation = "vs_undelete"
+
+    # update linked entities
+    if entities:
+        plan_fnt_vs_entities(changeset, vm_index, vs=vs, vm=vm, vs_attr_updateset=vs_attr_updateset)
+
+    # do we have attributes to update
+    if vs_attr_updateset:
+        changeset.add(operation, vm_index, vs["visibleId"], vs_elid=vs["elid"], attributes=vs_attr_updateset)
 
 
-def sync_fnt_vs_entities(command, vs, vm, vs_attr_updateset):
+def plan_fnt_vs_entities(changeset, key, vs, vm, vs_attr_updateset):
     vs_elid = vs["elid"]
     vs_name = vs["visibleId"]
-    hdd_total = hdd_used = 0
 
     for entity_class_name in FNT_VS_LINKED_ENTITIES:
         vs_entities = vs.get(entity_class_name)
-        # entity_class_name = FNT_VS_LINKED_ENTITIES[entity_class_name]["class_name"]
         entity_definition = FNT_VS_LINKED_ENTITIES[entity_class_name]
         entity_class_custom = entity_definition["class_custom"]
         entity_relation_class_name = entity_definition["relation_class_name"]
@@ -360,114 +1059,177 @@ def sync_fnt_vs_entities(command, vs, vm, vs_attr_updateset):
             if entity_class_name == "fileSystem":
                 vm_entity["capacityGb"] = gib_round(vm_entity["capacity"])
                 vm_entity["usedGb"] = gib_round(vm_entity["capacity"] - vm_entity["freeSpace"])
-                hdd_total += vm_entity["capacity"]
-                hdd_used += vm_entity["capacity"] - vm_entity["freeSpace"]
             for tm_entry in entity_transform_map:
                 vm_attr, vs_attr = tm_entry
                 if vm_entity[vm_attr] != normalize_none(vs_entity.get(vs_attr)):
                     entity_attr_updateset[vs_attr] = vm_entity[vm_attr]
 
             if entity_attr_updateset:
-                try:
-                    if vs_entity:
-                        command.update_entity(
-                            entity_type=entity_class_name,
-                            entity_elid=vs_entity["elid"],
-                            **entity_attr_updateset,
-                        )
-                        logger.debug(
-                            f"VirtualServer {vs_name}: Updated {entity_class_name}: {entity_attr_updateset}."
-                        )
-                    # new entity
-                    else:
-                        new_entity = command.create_entity(
-                            entity_type=entity_class_name,
-                            entity_custom=entity_class_custom,
-                            **entity_attr_updateset,
-                        )
-                        new_entity_elid = new_entity["elid"]
-                        new_entity_link = command.create_related_entities(
-                            entity_type="virtualServer",
-                            entity_elid=vs_elid,
-                            relation_type=entity_relation_class_name,
-                            linked_elid=new_entity_elid,
-                        )
-                        logger.info(
-                            f"VirtualServer {vs_name}: Created {entity_class_name}: {entity_attr_updateset}."
-                        )
-
-                except FNTException:
-                    logger.exception(
-                        f"VirtualServer {vs_name}: Failed to create/update {entity_class_name}: {entity_attr_updateset}."
+                if vs_entity:
+                    changeset.add(
+                        "entity_update",
+                        key,
+                        vs_name,
+                        vs_elid=vs_elid,
+                        entity_type=entity_class_name,
+                        entity_elid=vs_entity["elid"],
+                        attributes=entity_attr_updateset,
+                    )
+                # new entity
+                else:
+                    changeset.add(
+                        "entity_create",
+                        key,
+                        vs_name,
+                        vs_elid=vs_elid,
+                        entity_type=entity_class_name,
+                        entity_custom=entity_class_custom,
+                        relation_type=entity_relation_class_name,
+                        attributes=entity_attr_updateset,
                     )
 
-        cleanup_fnt_vs_entities(
-            command,
-            vs,
-            vm,
-            vs_entities,
-            entity_class_name,
-            vs_attr_updateset,
-            entity_index,
-            entity_class_custom,
-        )
+        # linked entities the vm no longer has
+        for entity in vs_entities:
+            linked_entity = vs_entities[entity]["entity"][entity_index]
+            if linked_entity not in vm_entities:
+                changeset.add(
+                    "entity_delete",
+                    key,
+                    vs_name,
+                    vs_elid=vs_elid,
+                    entity_type=entity_class_name,
+                    entity_custom=entity_class_custom,
+                    entity_elid=vs_entities[entity]["entity"]["elid"],
+                    linked_entity=linked_entity,
+                )
 
 
-# def create_update_fnt_vs_entities(command, entity_attr_updateset, vs_entity=None,
-# entity_class_name=None, entity_class_custom=False):
-#     try:
-#         if not vs_entity:
-#             command.create_entity(entity_type="virtualServer", **entity_attr_updateset)
-#             logger.info(f'Created VirtualServer {entity_attr_updateset["visibleId"]}.')
-#         else:
-#             command.update_entity(entity_type="virtualServer", entity_elid=vs_entity["elid"], **entity_attr_updateset)
-#             logger.info(f'Updated VirtualServer {vs_entity["visibleId"]}.')
-#         logger.debug(f"VirtualServer attributes: {entity_attr_updateset}")
-#     except FNTException:
-#         logger.error(f"Failed to create/update VirtualServer: {entity_attr_updateset}.")
-
-
-def cleanup_fnt_vs_entities(
-    command,
-    vs,
-    vm,
-    vs_entities,
-    entity_class_name,
-    vs_attr_updateset,
-    entity_index,
-    entity_class_custom,
-    # delete_if_empty=False,
+def plan_fnt_vs_cleanup(
+    command, fnt_virtualservers, vpoller_vms_indexed, skip_datasources=(), digests=None, changeset=None
 ):
+    if changeset is None:
+        changeset = FNTChangeset()
 
-    for entity in vs_entities:
-        linked_entity = vs_entities[entity]["entity"][entity_index]
-        vm_entities = vm.get(entity_index, [])
-        # safety check
-        # if not delete_if_empty and not vm_entities:
-        if not vm_entities and not yes_no(vs_attr_updateset.get("cSdiDeleted", "N")):
-            return
-        if linked_entity not in vm_entities:
-            # link_elid = entities[entity]["relation"]["linkElid"]
-            linked_elid = vs_entities[entity]["entity"]["elid"]
-
-            # deprecated
-            # if entity_class_name == "vmIpAddress":
-            #     if vs["cManagementInterface"] == linked_entity:
-            #         vs_attr_updateset["cManagementInterface"] = ""
-            #         # disable monitoring if mgmt ip changes and vm not deleted
-            #         if not yes_no(vs_attr_updateset.get("cSdiDeleted", "N")):
-            #             vs_attr_updateset["cSdiMonitoring"] = "N"
-            #             vs_attr_updateset["cSdiMonitoringSnmp"] = "N"
-
-            command.delete_entity(
-                entity_type=entity_class_name, entity_custom=entity_class_custom, entity_elid=linked_elid,
+    virtualservers = []
+    for vs in fnt_virtualservers:
+        vs_uuid = vs["cUuid"]
+        vs_datasource = vs["datasource"]
+        # safety: do not delete if the datasource was not fully collected
+        if vs_datasource in skip_datasources:
+            continue
+        vm_index = (vs_datasource, vs_uuid)
+        # safety: do not sync if no vms received
+        if vpoller_vms_indexed and not vpoller_vms_indexed.get(vm_index) and not yes_no(vs["cSdiDeleted"]):
+            virtualservers.append(vs)
+
+    if digests is not None:
+        for vs in virtualservers:
+            changeset.digests[vs["elid"]] = None
+        load_fnt_vs_entities(command, virtualservers)
+
+    for vs in virtualservers:
+        vm_index = (vs["datasource"], vs["cUuid"])
+        vs_attr_updateset = {"cSdiDeleted": "Y", "cSdiNewServer": "N", "cCSdiDelConfirmed": "N"}
+        plan_fnt_vs_entities(changeset, vm_index, vs=vs, vm={}, vs_attr_updateset=vs_attr_updateset)
+
+        if yes_no(vs["cSdiNewServer"]) and not yes_no(vs["cServerWithHistory"]):
+            changeset.add("vs_delete", vm_index, vs["visibleId"], vs_elid=vs["elid"])
+        else:
+            if yes_no(vs["cSdiNewServer"]):
+                vs_attr_updateset["cCSdiDelConfirmed"] = "Y"
+            changeset.add(
+                "vs_soft_delete", vm_index, vs["visibleId"], vs_elid=vs["elid"], attributes=vs_attr_updateset
             )
-            # command.delete_related_entities(
-            #     "virtualServer", vs_elid, entity_relation_class_name, link_elid
-            # )
-            logger.info(
-                f"VirtualServer {vs['visibleId']}: Deleted entity {entity_class_name}: {linked_entity}"
+
+    return changeset
+
+
+def apply_fnt_changeset(command, changeset, digests=None, workers=None):
+    if workers is None:
+        workers = vfzsync.CONFIG["command"].get("workers", 1)
+
+    # operations of the same vs stay ordered
+    futures = {}
+    with KeyedExecutor(workers) as executor:
+        for key, operations in changeset.grouped().items():
+            future = executor.submit(key, apply_fnt_vs_operations, command, operations)
+            future.add_done_callback(log_task_exception)
+            for operation in operations:
+                if "vs_elid" in operation:
+                    futures[operation["vs_elid"]] = future
+    if changeset.operations:
+        expire_fnt_vs_replica()
+
+    if digests is not None:
+        for vs_elid, digest in changeset.digests.items():
+            if digest is None:
+                digests.drop(vs_elid)
+            elif vs_elid not in futures or (not futures[vs_elid].exception() and futures[vs_elid].result()):
+                digests.put(vs_elid, digest)
+
+
+def apply_fnt_vs_operations(command, operations):
+    success = True
+    for operation in operations:
+        try:
+            apply_fnt_operation(command, operation)
+        except FNTException:
+            logger.exception(
+                f'VirtualServer {operation["name"]}: Failed to {operation["operation"]}: {operation.get("attributes")}.'
             )
+            success = False
+            # a failed create/update of one entity does not block the others
+            if operation["operation"] not in ("entity_create", "entity_update"):
+                break
+    return success
+
+
+def apply_fnt_operation(command, operation):
+    name = operation["name"]
+    attributes = operation.get("attributes", {})
+
+    if operation["operation"] == "vs_create":
+        command.create_entity(entity_type="virtualServer", **attributes)
+        logger.info(f"Created VirtualServer {name}.")
+        logger.debug(f"VirtualServer attributes: {attributes}")
+
+    elif operation["operation"] in ("vs_update", "vs_undelete", "vs_soft_delete"):
+        command.update_entity(entity_type="virtualServer", entity_elid=operation["vs_elid"], **attributes)
+        logger.info(f"Updated VirtualServer {name}.")
+        logger.debug(f"VirtualServer attributes: {attributes}")
+
+    elif operation["operation"] == "vs_delete":
+        command.delete_entity(entity_type="virtualServer", entity_elid=operation["vs_elid"])
+        logger.info(f"Deleted VirtualServer {name}.")
+
+    elif operation["operation"] == "entity_update":
+        command.update_entity(
+            entity_type=operation["entity_type"], entity_elid=operation["entity_elid"], **attributes
+        )
+        logger.debug(f'VirtualServer {name}: Updated {operation["entity_type"]}: {attributes}.')
+
+    elif operation["operation"] == "entity_create":
+        new_entity = command.create_entity(
+            entity_type=operation["entity_type"], entity_custom=operation["entity_custom"], **attributes
+        )
+        command.create_related_entities(
+            entity_type="virtualServer",
+            entity_elid=operation["vs_elid"],
+            relation_type=operation["relation_type"],
+            linked_elid=new_entity["elid"],
+        )
+        logger.info(f'VirtualServer {name}: Created {operation["entity_type"]}: {attributes}.')
+
+    elif operation["operation"] == "entity_delete":
+        command.delete_entity(
+            entity_type=operation["entity_type"],
+            entity_custom=operation["entity_custom"],
+            entity_elid=operation["entity_elid"],
+        )
+        logger.info(f'VirtualServer {name}: Deleted entity {operation["entity_type"]}: {operation["linked_entity"]}')
+
+    else:
+        raise VFZException(f'Unknown FNT operation {operation["operation"]}')
 
 
 def create_update_fnt_vs(command, vs_attr_updateset, vs=None):
@@ -484,57 +1246,129 @@ def create_update_fnt_vs(command, vs_attr_updateset, vs=None):
             logger.info(f'Updated VirtualServer {vs["visibleId"]}.')
 
         logger.debug(f"VirtualServer attributes: {vs_attr_updateset}")
+        expire_fnt_vs_replica()
         return return_data
     except FNTException as e:
         logger.exception(e)
         logger.error(f"Failed to create/update VirtualServer: {vs_attr_updateset}.")
 
 
-def cleanup_fnt_vs(command, fnt_virtualservers, vpoller_vms_indexed):
-    for vs in fnt_virtualservers:
-        vs_uuid = vs["cUuid"]
-        vs_datasource = vs["datasource"]
-        vm_index = (vs_datasource, vs_uuid)
-        vs_attr_updateset = {}
-        # safety: do not sync if no vms received
-        if vpoller_vms_indexed and not vpoller_vms_indexed.get(vm_index) and not yes_no(vs["cSdiDeleted"]):
-            vs_attr_updateset = {"cSdiDeleted": "Y", "cSdiNewServer": "N", "cCSdiDelConfirmed": "N"}
-            try:
-                sync_fnt_vs_entities(command, vs=vs, vm={}, vs_attr_updateset=vs_attr_updateset)
-
-                action = "update"
-                if yes_no(vs["cSdiNewServer"]):
-                    if yes_no(vs["cServerWithHistory"]):
-                        vs_attr_updateset["cCSdiDelConfirmed"] = "Y"
-                    else:
-                        action = "delete"
-
-                if action == "update":
-                    command.update_entity(
-                        entity_type="virtualServer", entity_elid=vs["elid"], **vs_attr_updateset
-                    )
-                    logger.info(f'Updated VirtualServer {vs["visibleId"]}.')
-                    logger.debug(f'VirtualServer {vs["visibleId"]} update set: {vs_attr_updateset}')
-                if action == "delete":
-                    command.delete_entity(entity_type="virtualServer", entity_elid=vs["elid"])
-                    logger.info(f'Deleted VirtualServer {vs["visibleId"]}.')
-
-            except FNTException as e:
-                logger.error(f"Failed to create/update/delete VirtualServer: {vs_attr_updateset}.")
-                logger.exception(str(e))
+def sync_fnt_vs_stream(command, vpoller_vms, fnt_virtualservers_indexed, digests=None, dryrun=False):
+    """ Plans and applies the changes vm by vm, while vPoller is still collecting """
+    changeset = FNTChangeset()
 
+    def sync_vm(vm):
+        vm_changeset = plan_fnt_vs_sync(command, [vm], fnt_virtualservers_indexed, digests=digests)
+        if not dryrun:
+            apply_fnt_changeset(command, vm_changeset, digests=digests, workers=1)
+        changeset.merge(vm_changeset)
+
+    with KeyedExecutor(vfzsync.CONFIG["command"].get("workers", 1)) as executor:
+        for vm in vpoller_vms:
+            vm_index = (vm["vc_host"], vm["config.instanceUuid"])
+            future = executor.submit(vm_index, sync_vm, vm)
+            future.add_done_callback(log_task_exception)
+
+    return changeset
+
+
+def dump_fnt_changeset(changeset):
+    path = get_cache_path("fnt_changeset.json")
+    save_cache(path, changeset.to_json())
+    logger.info(f"FNT changeset written to {path}.")
 
-def sync_zabbix_hosts(zapi, fnt_virtualservers, zabbix_hosts_indexed_by_host):
-    #done #foreach
-    zabbix_hostgroup_id = get_zabbix_hostgroupid_by_name(zapi, vfzsync.CONFIG["zabbix"]["hostgroup"])
-    zabbix_template_id = get_zabbix_templateid_by_name(zapi, vfzsync.CONFIG["zabbix"]["template"])
-    zabbix_proxy_id = get_zabbix_proxyid_by_name(zapi, vfzsync.CONFIG["zabbix"]["proxy"]["host"])
 
-    hostids = [zabbix_hosts_indexed_by_host[hostname]["hostid"] for hostname in zabbix_hosts_indexed_by_host]
-    triggers, triggers_indexed_by_hostids = get_zabbix_triggers(
-        zapi=zapi, mode="sync", groupids=zabbix_hostgroup_id
+class ZabbixChangeset:
+    """ Planned FNT -> Zabbix changes, in execution order per host """
+
+    OPERATIONS = (
+        "host_create",
+        "send",
+        "item_update",
+        "trigger_update",
+        "hostinterface_update",
+        "host_update",
     )
-    items, items_indexed_by_hostids = get_zabbix_items(zapi=zapi, groupids=zabbix_hostgroup_id)
+
+    def __init__(self):
+        super().__init__()
+        self.operations = []
+
+    def add(self, operation, key, name, params):
+        self.operations.append({"operation": operation, "key": key, "name": name, "params": params})
+
+    def grouped(self):
+        groups = {}
+        for operation in self.operations:
+            groups.setdefault(operation["key"], []).append(operation)
+        return groups
+
+    def counts(self):
+        counts = {operation: 0 for operation in self.OPERATIONS}
+        for operation in self.operations:
+            counts[operation["operation"]] += 1
+        return counts
+
+    def log_counts(self, title):
+        counts = ", ".join(f"{operation}={count}" for operation, count in self.counts().items())
+        logger.info(f"{title}: {counts}.")
+
+    def to_json(self):
+        return {"counts": self.counts(), "operations": self.operations}
+
+
+def get_zabbix_sync_state(zapi):
+    """ Everything plan_zabbix_sync needs besides FNT and the hosts, JSON serializable """
+    zabbix_hostgroup_id = get_zabbix_hostgroupid_by_name(zapi, vfzsync.CONFIG["zabbix"]["hostgroup"])
+    return {
+        "hostgroup_id": zabbix_hostgroup_id,
+        "template_id": get_zabbix_templateid_by_name(zapi, vfzsync.CONFIG["zabbix"]["template"]),
+        "proxy_id": get_zabbix_proxyid_by_name(zapi, vfzsync.CONFIG["zabbix"]["proxy"]["host"]),
+        "flags_indexed_by_hostids": get_zabbix_flag_index(
+            zapi, groupids=zabbix_hostgroup_id, flags=FNT_ZABBIX_FLAG_TRIGGERS
+        ),
+    }
+
+
+def invalidate_zabbix_sync_ids():
+    zabbix_id_cache.invalidate("hostgroup", vfzsync.CONFIG["zabbix"]["hostgroup"])
+    zabbix_id_cache.invalidate("template", vfzsync.CONFIG["zabbix"]["template"])
+    zabbix_id_cache.invalidate("proxy", vfzsync.CONFIG["zabbix"]["proxy"]["host"])
+
+
+def refresh_zabbix_sync_ids(zapi):
+    """
+    Looks up the cached host group/template/proxy IDs again, returns the
+    host.create params using them, empty if the lookup failed
+    """
+    invalidate_zabbix_sync_ids()
+    try:
+        return {
+            "groups": [{"groupid": get_zabbix_hostgroupid_by_name(zapi, vfzsync.CONFIG["zabbix"]["hostgroup"])}],
+            "templates": [{"templateid": get_zabbix_templateid_by_name(zapi, vfzsync.CONFIG["zabbix"]["template"])}],
+            "proxy_hostid": str(get_zabbix_proxyid_by_name(zapi, vfzsync.CONFIG["zabbix"]["proxy"]["host"])),
+        }
+    except (ZabbixAPIException, LookupError):
+        logger.exception("Failed to look up Zabbix host group/template/proxy IDs.")
+        return {}
+
+
+def sync_zabbix_hosts(zapi, fnt_virtualservers, zabbix_hosts_indexed_by_host, dryrun=False):
+    #done #foreach
+    state = get_zabbix_sync_state(zapi)
+    changeset = plan_zabbix_sync(fnt_virtualservers, zabbix_hosts_indexed_by_host, state)
+    changeset.log_counts("Zabbix changeset")
+    if dryrun:
+        logger.warning("Dry run, Zabbix changeset not applied.")
+        return changeset
+    apply_zabbix_changeset(zapi, changeset)
+    return changeset
+
+
+def plan_zabbix_sync(fnt_virtualservers, zabbix_hosts_indexed_by_host, state, changeset=None):
+    """ Offline: compares FNT virtual servers with the fetched hosts, items and triggers """
+    if changeset is None:
+        changeset = ZabbixChangeset()
 
     counter = ProgressCounter(len(fnt_virtualservers), 25, 60)
     for vs in fnt_virtualservers:
@@ -546,192 +1380,450 @@ def sync_zabbix_hosts(zapi, fnt_virtualservers, zabbix_hosts_indexed_by_host):
         if yes_no(vs["cSdiNewServer"]):
             continue
         host = zabbix_hosts_indexed_by_host.get(vs["id"], {})
-        host_updateset = {}
-        hostinterface_updateset = {}
-        hostmacros_updateset = [
-            {"macro": "{$SNMP_COMMUNITY}", "value": vs["cCommunityName"]},
-            {"macro": "{$VSPHERE.HOST}", "value": vs["datasource"]},
-            {"macro": "{$HOST_PURPOSE}", "value": vs["cSdiPurpose"]},
-            {"macro": "{$VS_VISIBLE_ID}", "value": vs["visibleId"]}
-        ]
-        vs_id = first(re.findall(r"\d+", vs["id"]))
-        host_name_new = f'{vs["visibleId"]} [#{vs_id}]'
-
-        if not host:
-            # create host
-            if (
-                vs["cManagementInterface"]
-                and not yes_no(vs["cSdiDeleted"])
-                # and vs["cManagementInterface"] != "0.0.0.0"
-            ):
-                # name = f'{vs["visibleId"]} [{vs["id"]}]',
-                host_updateset = {
-                    "host": vs["id"],
-                    "name": host_name_new,
-                    "groups": [{"groupid": zabbix_hostgroup_id}],
-                    "interfaces": [
-                        {
-                            "type": 2,
-                            "main": 1,
-                            "useip": 1,
-                            "ip": vs["cManagementInterface"],
-                            "dns": "",
-                            "port": "161",
-                            "details": {"version": 2, "community": "{$SNMP_COMMUNITY}", "bulk": 0},
-                        }
-                    ],
-                    "macros": hostmacros_updateset,
-                    "templates": [{"templateid": zabbix_template_id}],
-                    "proxy_hostid": str(zabbix_proxy_id),
-                    "inventory_mode": 0,
-                    "inventory": {
-                        "location": vs["datasource"],
-                        "name": vs["visibleId"]
-                    }
+        try:
+            if not host:
+                plan_zabbix_host_create(changeset, vs, state)
+            else:
+                plan_zabbix_host_update(changeset, vs, host, state)
+        except (KeyError, IndexError):
+            logger.exception(f'Failed to plan Zabbix host {vs["visibleId"]}.')
+
+    return changeset
+
+
+def get_zabbix_host_macros(vs):
+    return [
+        {"macro": "{$SNMP_COMMUNITY}", "value": vs["cCommunityName"]},
+        {"macro": "{$VSPHERE.HOST}", "value": vs["datasource"]},
+        {"macro": "{$HOST_PURPOSE}", "value": vs["cSdiPurpose"]},
+        {"macro": "{$VS_VISIBLE_ID}", "value": vs["visibleId"]}
+    ]
+
+
+def get_zabbix_host_name(vs):
+    vs_id = first(re.findall(r"\d+", vs["id"]))
+    return f'{vs["visibleId"]} [#{vs_id}]'
+
+
+def plan_zabbix_host_create(changeset, vs, state):
+    if (
+        vs["cManagementInterface"]
+        and not yes_no(vs["cSdiDeleted"])
+        # and vs["cManagementInterface"] != "0.0.0.0"
+    ):
+        # name = f'{vs["visibleId"]} [{vs["id"]}]',
+        host_updateset = {
+            "host": vs["id"],
+            "name": get_zabbix_host_name(vs),
+            "groups": [{"groupid": state["hostgroup_id"]}],
+            "interfaces": [
+                {
+                    "type": 2,
+                    "main": 1,
+                    "useip": 1,
+                    "ip": vs["cManagementInterface"],
+                    "dns": "",
+                    "port": "161",
+                    "details": {"version": 2, "community": "{$SNMP_COMMUNITY}", "bulk": 0},
                 }
-
-                try:
-                    newhost = zapi.host.create(**host_updateset)
-                    newhost_id = newhost["hostids"][0]
-                    app_updateset = {"name": f'elid_{vs["elid"]}', "hostid": newhost_id}
-                    elid_app = zapi.application.create(**app_updateset)
-                except ZabbixAPIException:
-                    logger.exception(
-                        f'Failed to create Zabbix host {vs["visibleId"]}.\nHost updateset: {host_updateset}'
-                    )
-                else:
-                    logger.info(f'Created Zabbix host {vs["visibleId"]}.')
-        else:
-            # update/delete host
-            host_id = host["hostid"]
-            host_macros = {}
-            if host["macros"]:
-                for macro in host["macros"]:
-                    host_macros[macro["macro"]] = macro["value"]
-
-            host_purpose = host_macros.get("{$HOST_PURPOSE}", "")
-            host_community = host_macros.get("{$SNMP_COMMUNITY}", "public")
-            host_vsphere_host = host_macros.get("{$VSPHERE.HOST}", "")
-            host_visible_id = host_macros.get("{$VS_VISIBLE_ID}", "")
-
-            host_interface = host["interfaces"][0]
-            host_interface_id = host_interface["interfaceid"]
-            host_ip = host_interface["ip"]
-            host_name = host["name"]
-            host_description = host["description"]
-
-            host_triggers = triggers_indexed_by_hostids[host_id]
-            host_triggers_by_tag = {
-                trigger["tag"]: trigger for trigger in host_triggers if trigger.get("tag")
+            ],
+            "macros": get_zabbix_host_macros(vs),
+            "templates": [{"templateid": state["template_id"]}],
+            "proxy_hostid": str(state["proxy_id"]),
+            "inventory_mode": 0,
+            "inventory": {
+                "location": vs["datasource"],
+                "name": vs["visibleId"]
             }
-            host_items = items_indexed_by_hostids[host_id]
-            host_items_indexed_by_app = {}
-            for item in host_items:
-                for app in item["applications"]:
-                    if not host_items_indexed_by_app.get(app["name"]):
-                        host_items_indexed_by_app[app["name"]] = []
-                    host_items_indexed_by_app[app["name"]].append(item)
-            
-            if host_name != host_name_new:
-                host_updateset["name"] = host_name_new
-            if host['inventory']['name'] != vs["visibleId"]:
-                host_updateset['inventory'] = {}
-                host_updateset['inventory']["name"] = vs["visibleId"]
-
-            if vs["cManagementInterface"] and host_ip != vs["cManagementInterface"]:
-                hostinterface_updateset = {"interfaceid": host_interface_id, "ip": vs["cManagementInterface"]}
-
-            if (
-                (host_community != vs["cCommunityName"])
-                or (host_purpose != vs["cSdiPurpose"])
-                or (host_vsphere_host != vs["datasource"])
-                or (host_visible_id != vs["visibleId"])
-            ):
-                host_updateset["macros"] = hostmacros_updateset
-
-            host_status = "1"
-            hostitems_updateset = []
-            hosttriggers_updateset = []
-            host_senderset = []
-
-            for vs_flag in FNT_ZABBIX_FLAG_TRIGGERS:
-                # enable host if has active checks
-                if yes_no(vs[vs_flag]):
-                    host_status = "0"
-                trigger = host_triggers_by_tag[vs_flag]
-                vs_flag_status = int(not yes_no(vs[vs_flag]))
-                items = host_items_indexed_by_app[vs_flag]
-                for item in items:
-                    if vs_flag_status != int(item["status"]):
-                        hostitems_updateset.append({"itemid": item["itemid"], "status": vs_flag_status})
-                if vs_flag_status != int(trigger["status"]):
-                    hosttriggers_updateset.append(
-                        {"triggerid": host_triggers_by_tag[vs_flag]["triggerid"], "status": vs_flag_status}
-                    )
-                    trigger_status = int(yes_no(vs[vs_flag])) - 1
-                    metric = ZabbixMetric(host["host"], f"trigger.status[{vs_flag}]", trigger_status)
-                    host_senderset.append(metric)
+        }
+        changeset.add(
+            "host_create",
+            vs["id"],
+            vs["visibleId"],
+            {"host": host_updateset, "application": {"name": f'elid_{vs["elid"]}'}},
+        )
 
-            try:
-                if host_senderset:
-                    result = zabbix_send(host_senderset)
-            except Exception as e:
-                logger.exception(f'Failed to send to Zabbix payload:\n{host_senderset}\n{str(e)}.')
 
-            # disable host if no triggers enabled
-            if host_status != host["status"]:
-                host_updateset["status"] = host_status
+def plan_zabbix_host_update(changeset, vs, host, state):
+    host_id = host["hostid"]
+    host_updateset = {}
+    hostinterface_updateset = {}
+    host_macros = {}
+    if host["macros"]:
+        for macro in host["macros"]:
+            host_macros[macro["macro"]] = macro["value"]
+
+    host_purpose = host_macros.get("{$HOST_PURPOSE}", "")
+    host_community = host_macros.get("{$SNMP_COMMUNITY}", "public")
+    host_vsphere_host = host_macros.get("{$VSPHERE.HOST}", "")
+    host_visible_id = host_macros.get("{$VS_VISIBLE_ID}", "")
+
+    host_interface = host["interfaces"][0]
+    host_interface_id = host_interface["interfaceid"]
+    host_ip = host_interface["ip"]
+    host_name = host["name"]
+
+    host_flags = state["flags_indexed_by_hostids"][host_id]
+
+    host_name_new = get_zabbix_host_name(vs)
+    if host_name != host_name_new:
+        host_updateset["name"] = host_name_new
+    if host['inventory']['name'] != vs["visibleId"]:
+        host_updateset['inventory'] = {}
+        host_updateset['inventory']["name"] = vs["visibleId"]
+
+    if vs["cManagementInterface"] and host_ip != vs["cManagementInterface"]:
+        hostinterface_updateset = {"interfaceid": host_interface_id, "ip": vs["cManagementInterface"]}
+
+    if (
+        (host_community != vs["cCommunityName"])
+        or (host_purpose != vs["cSdiPurpose"])
+        or (host_vsphere_host != vs["datasource"])
+        or (host_visible_id != vs["visibleId"])
+    ):
+        host_updateset["macros"] = get_zabbix_host_macros(vs)
+
+    host_status = "1"
+    hostitems_updateset = []
+    hosttriggers_updateset = []
+    host_senderset = []
+
+    for vs_flag in FNT_ZABBIX_FLAG_TRIGGERS:
+        # enable host if has active checks
+        if yes_no(vs[vs_flag]):
+            host_status = "0"
+        trigger = host_flags[vs_flag]["trigger"]
+        vs_flag_status = int(not yes_no(vs[vs_flag]))
+        for item in host_flags[vs_flag]["items"]:
+            if vs_flag_status != int(item["status"]):
+                hostitems_updateset.append({"itemid": item["itemid"], "status": vs_flag_status})
+        if vs_flag_status != int(trigger["status"]):
+            hosttriggers_updateset.append({"triggerid": trigger["triggerid"], "status": vs_flag_status})
+            trigger_status = int(yes_no(vs[vs_flag])) - 1
+            host_senderset.append({"host": host["host"], "key": f"trigger.status[{vs_flag}]", "value": trigger_status})
+
+    # disable host if no triggers enabled
+    if host_status != host["status"]:
+        host_updateset["status"] = host_status
+
+    key = vs["id"]
+    name = vs["visibleId"]
+    if host_senderset:
+        changeset.add("send", key, name, host_senderset)
+    if hostitems_updateset:
+        changeset.add("item_update", key, name, hostitems_updateset)
+    if hosttriggers_updateset:
+        changeset.add("trigger_update", key, name, hosttriggers_updateset)
+    if hostinterface_updateset:
+        changeset.add("hostinterface_update", key, name, hostinterface_updateset)
+    if host_updateset:
+        host_updateset["hostid"] = host_id
+        changeset.add("host_update", key, name, host_updateset)
+
+
+class ZabbixBatch:
+    """ Update params of one API method collected across hosts, sent in chunks """
+
+    def __init__(self, method, chunk_size):
+        super().__init__()
+        self.method = method
+        self.chunk_size = chunk_size
+        self.entries = []
+
+    def add(self, key, name, params):
+        if isinstance(params, dict):
+            params = [params]
+        self.entries.append((key, name, params))
+
+    def call(self, zapi, params):
+        api_object, api_method = self.method.split(".")
+        return getattr(getattr(zapi, api_object), api_method)(*params)
+
+    def flush(self, zapi, failed):
+        """ Sends the collected params, adds the keys of hosts that failed to `failed` """
+        entries = [entry for entry in self.entries if entry[0] not in failed]
+        batch = []
+        batch_size = 0
+        for entry in entries:
+            batch.append(entry)
+            batch_size += len(entry[2])
+            if batch_size >= self.chunk_size:
+                self._send(zapi, batch, failed)
+                batch = []
+                batch_size = 0
+        if batch:
+            self._send(zapi, batch, failed)
+        self.entries = []
+
+    def _send(self, zapi, batch, failed):
+        params = flatten(entry[2] for entry in batch)
+        logger.debug(f"Zabbix {self.method}: {len(params)} objects of {len(batch)} hosts.")
+        try:
+            self.call(zapi, params)
+            return
+        except ZabbixAPIException as e:
+            if len(batch) == 1:
+                key, name, params = batch[0]
+                logger.exception(f"Failed to update Zabbix host {name}.")
+                failed.add(key)
+                return
+            logger.warning(
+                f"Zabbix {self.method} failed for {len(batch)} hosts ({e}), retrying host by host."
+            )
 
+        # find the hosts the error belongs to
+        for key, name, params in batch:
             try:
-                if hostitems_updateset:
-                    logger.debug(f'Zabbix host {vs["visibleId"]} update set: {hostitems_updateset}')
-                    zapi.item.update(*hostitems_updateset)
-
-                if hosttriggers_updateset:
-                    logger.debug(f'Zabbix host {vs["visibleId"]} update set: {hosttriggers_updateset}')
-                    zapi.trigger.update(*hosttriggers_updateset)
-
-                if hostinterface_updateset:
-                    logger.debug(f'Zabbix host {vs["visibleId"]} update set: {hostinterface_updateset}')
-                    zapi.hostinterface.update(**hostinterface_updateset)
-
-                if host_updateset:
-                    host_updateset["hostid"] = host_id
-                    logger.debug(f'Zabbix host {vs["visibleId"]} update set: {host_updateset}')
-                    result = zapi.host.update(**host_updateset)
-
+                self.call(zapi, params)
             except ZabbixAPIException:
-                logger.exception(f'Failed to update Zabbix host {vs["visibleId"]}.')
+                logger.exception(f"Failed to update Zabbix host {name}.")
+                failed.add(key)
+
+
+def apply_zabbix_changeset(zapi, changeset):
+    chunk_size = vfzsync.CONFIG["zabbix"].get("chunk_size", 500)
+    batches = {operation: ZabbixBatch(method, chunk_size) for operation, method in ZABBIX_BATCH_METHODS.items()}
+    sender_state = get_zabbix_sent_state()
+    sender = ZabbixSenderBuffer(state=sender_state)
+    updated = {}
+    failed = set()
+
+    host_creates = []
+
+    for operation in changeset.operations:
+        if operation["operation"] in batches:
+            batches[operation["operation"]].add(operation["key"], operation["name"], operation["params"])
+            updated[operation["key"]] = operation["name"]
+        elif operation["operation"] == "send":
+            sender.add([ZabbixMetric(metric["host"], metric["key"], metric["value"]) for metric in operation["params"]])
+        elif operation["operation"] == "host_create":
+            host_creates.append(operation)
+
+    create_zabbix_hosts(zapi, host_creates, chunk_size)
+
+    # trapper values of the whole sync in one flush, before host.update may disable hosts
+    sender.flush()
+    if sender_state is not None:
+        sender_state.save()
+
+    # same order as per host: items, triggers, interface, host; a failed host is skipped afterwards
+    host_updates = {entry[0] for entry in batches["host_update"].entries}
+    for batch in batches.values():
+        batch.flush(zapi, failed)
+    if host_updates & failed:
+        # hosts may have failed on a host group/template/proxy that changed, look them up again next time
+        invalidate_zabbix_sync_ids()
+
+    for key, name in updated.items():
+        if key not in failed:
+            logger.info(f"Updated Zabbix host {name}.")
+
+    return sender
+
+
+def create_zabbix_hosts(zapi, operations, chunk_size):
+    """ host.create in chunks, then application.create for all new hosts """
+    applications = []
+    refreshed_ids = None
+    for operations_chunk in chunks(operations, chunk_size):
+        for operation in operations_chunk:
+            operation["params"]["host"].update(refreshed_ids or {})
+        try:
+            hostids = zapi.host.create(*[operation["params"]["host"] for operation in operations_chunk])["hostids"]
+        except ZabbixAPIException as e:
+            if len(operations_chunk) > 1:
+                logger.warning(
+                    f"Zabbix host.create failed for {len(operations_chunk)} hosts ({e}), retrying host by host."
+                )
+            hostids = []
+            for operation in operations_chunk:
+                operation["params"]["host"].update(refreshed_ids or {})
+                try:
+                    hostid = zapi.host.create(**operation["params"]["host"])["hostids"][0]
+                except ZabbixAPIException:
+                    # the cached group/template/proxy IDs may be stale: look them up once, retry if they changed
+                    if refreshed_ids is None:
+                        refreshed_ids = refresh_zabbix_sync_ids(zapi)
+                    host_params = {**operation["params"]["host"], **refreshed_ids}
+                    hostid = None
+                    if host_params != operation["params"]["host"]:
+                        operation["params"]["host"] = host_params
+                        try:
+                            hostid = zapi.host.create(**host_params)["hostids"][0]
+                        except ZabbixAPIException:
+                            pass
+                    if hostid is None:
+                        logger.exception(
+                            f'Failed to create Zabbix host {operation["name"]}.\nHost updateset: {operation["params"]["host"]}'
+                        )
+                hostids.append(hostid)
+
+        for operation, hostid in zip(operations_chunk, hostids):
+            if hostid is not None:
+                applications.append((operation, {**operation["params"]["application"], "hostid": hostid}))
 
-            if any([hostitems_updateset, hosttriggers_updateset, hostinterface_updateset, host_updateset]):
-                logger.info(f'Updated Zabbix host {vs["visibleId"]}.')
+    for applications_chunk in chunks(applications, chunk_size):
+        try:
+            zapi.application.create(*[application for operation, application in applications_chunk])
+        except ZabbixAPIException as e:
+            if len(applications_chunk) > 1:
+                logger.warning(
+                    f"Zabbix application.create failed for {len(applications_chunk)} hosts ({e}), retrying host by host."
+                )
+            for operation, application in applications_chunk:
+                try:
+                    zapi.application.create(**application)
+                except ZabbixAPIException:
+                    logger.exception(f'Failed to create Zabbix host {operation["name"]} application {application}.')
+                else:
+                    logger.info(f'Created Zabbix host {operation["name"]}.')
+        else:
+            for operation, application in applications_chunk:
+                logger.info(f'Created Zabbix host {operation["name"]}.')
 
 
-def cleanup_zabbix_hosts(zapi, zabbix_hosts, fnt_virtualservers_indexed):
+def cleanup_zabbix_hosts(zapi, zabbix_hosts, fnt_virtualservers_indexed, dryrun=False):
+    """ Returns the deleted hosts, in dry run the ones that would be deleted """
+    deleted = []
     for host in zabbix_hosts:
         host_id = host["hostid"]
         host_index = (host["host"],)
         vs = fnt_virtualservers_indexed.get(host_index, {})
         # don't delete if no data from FNT
         if fnt_virtualservers_indexed and (yes_no(vs.get("cSdiDeleted", "N")) or not vs):
+            if dryrun:
+                deleted.append(host)
+                logger.warning(f'Dry run, Zabbix host {host["name"]} not deleted.')
+                continue
             try:
                 zapi.host.delete(host_id)
             except ZabbixAPIException:
                 logger.exception(f'Failed to delete Zabbix host {host["name"]}.')
             else:
+                deleted.append(host)
                 logger.info(f'Deleted Zabbix host {host["name"]}.')
+    return deleted
 
 
-def zabbix_send(senderset):
-    sender = ZabbixSender(zabbix_server=vfzsync.CONFIG["zabbix"]["proxy"]["host"], zabbix_port=vfzsync.CONFIG["zabbix"]["proxy"]["port"])
-    try:
-        result = sender.send(senderset)
-    except Exception as e:
-        logger.exception(str(e))
-    else:
-        if result.failed > 0:
-            logger.debug(f"Send started with args: {senderset} and has failed: {result}")
-        return result
+class ZabbixSentState:
+    """ Last value sent to the trapper per (host, key) """
+
+    def __init__(self, path, heartbeat):
+        super().__init__()
+        self.path = path
+        self.heartbeat = heartbeat
+        self.suppressed = 0
+        self._lock = threading.Lock()
+        self._entries = load_cache(path)
+
+    @staticmethod
+    def key(host, key):
+        return f"{host}|{key}"
+
+    def changed(self, host, key, value):
+        entry = self._entries.get(self.key(host, key))
+        # resend unchanged values once per heartbeat
+        changed = (
+            entry is None
+            or entry["value"] != value
+            or time.time() - entry["sent"] >= self.heartbeat
+        )
+        if not changed:
+            with self._lock:
+                self.suppressed += 1
+        return changed
+
+    def put(self, host, key, value):
+        with self._lock:
+            self._entries[self.key(host, key)] = {"value": value, "sent": time.time()}
+
+    def save(self):
+        # other processes (cron runs, the web app) share the file: merge under a lock, newest send wins
+        try:
+            with open(f"{self.path}.lock", mode="w") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                entries = load_cache(self.path)
+                with self._lock:
+                    for key, entry in self._entries.items():
+                        if key not in entries or entries[key]["sent"] < entry["sent"]:
+                            entries[key] = entry
+                    self._entries = entries
+                save_cache(self.path, entries)
+        except OSError:
+            logger.exception(f"Failed to lock cache {self.path}.")
+
+
+def get_zabbix_sent_state():
+    config_state = vfzsync.CONFIG["zabbix"].get("sender_state", {})
+    if not config_state.get("enabled"):
+        return None
+    return ZabbixSentState(get_cache_path("zabbix_sent.json"), config_state.get("heartbeat", 3600))
+
+
+class ZabbixSenderBuffer:
+    """
+    Trapper metrics buffered during a run and flushed at once in chunks.
+    The trapper protocol closes the connection after every response, so
+    the sender still connects once per chunk, not once per host.
+    With a ZabbixSentState only values that changed since the last send go out.
+    """
+
+    def __init__(self, state=None, force=False):
+        super().__init__()
+        self.state = state
+        self.force = force
+        self.chunk_size = vfzsync.CONFIG["zabbix"].get("sender_chunk_size", 250)
+        self.sender = ZabbixSender(
+            zabbix_server=vfzsync.CONFIG["zabbix"]["proxy"]["host"],
+            zabbix_port=vfzsync.CONFIG["zabbix"]["proxy"]["port"],
+            chunk_size=self.chunk_size,
+        )
+        self.metrics = []
+        self.processed = 0
+        self.failed = 0
+        self.total = 0
+
+    def add(self, metrics):
+        if self.state is not None and not self.force:
+            metrics = [metric for metric in metrics if self.state.changed(metric.host, metric.key, metric.value)]
+        self.metrics += metrics
+
+    def flush(self):
+        metrics, self.metrics = self.metrics, []
+        if self.state is not None and self.state.suppressed:
+            logger.info(f"Zabbix sender: {self.state.suppressed} unchanged values not sent.")
+        if not metrics:
+            return None
+        # chunk by chunk: a response only says how many values failed, not which
+        for metrics_chunk in chunks(metrics, self.chunk_size):
+            try:
+                result = self.sender.send(metrics_chunk)
+            except Exception as e:
+                self.failed += len(metrics_chunk)
+                self.total += len(metrics_chunk)
+                logger.exception(str(e))
+                continue
+
+            self.processed += result.processed
+            self.failed += result.failed
+            self.total += result.total
+            if result.failed > 0:
+                # keep the whole chunk unrecorded, it is sent again next run
+                logger.debug(f"Send started with args: {metrics_chunk} and has failed: {result}")
+            elif self.state is not None:
+                for metric in metrics_chunk:
+                    self.state.put(metric.host, metric.key, metric.value)
+        logger.info(f"Zabbix sender: {self.processed} processed, {self.failed} failed of {self.total}.")
+        return self
+
+
+def zabbix_send(senderset, state=None, force=False):
+    sender = ZabbixSenderBuffer(state=state, force=force)
+    sender.add(senderset)
+    result = sender.flush()
+    if state is not None:
+        state.save()
+    return result
 
 
 class VFZSync:
@@ -745,6 +1837,7 @@ class VFZSync:
                     vpoller_endpoint=vfzsync.CONFIG["vpoller"]["endpoint"],
                     vpoller_retries=vfzsync.CONFIG["vpoller"]["retries"],
                     vpoller_timeout=vfzsync.CONFIG["vpoller"]["timeout"],
+                    vpoller_inflight=vfzsync.CONFIG["vpoller"].get("inflight", 0),
                 )
                 self._vcenters = [vc for vc in vfzsync.CONFIG["vpoller"]["vc_hosts"] if vc]
                 for vc_host in self._vcenters:
@@ -761,6 +1854,9 @@ class VFZSync:
                     url=vfzsync.CONFIG["command"]["url"],
                     username=vfzsync.CONFIG["command"]["username"],
                     password=vfzsync.CONFIG["command"]["password"],
+                    pool_size=vfzsync.CONFIG["command"].get("pool_size", 10),
+                    timeout=vfzsync.CONFIG["command"].get("timeout", 5),
+                    session_expired_codes=vfzsync.CONFIG["command"].get("session_expired_codes"),
                 )
             except FNTNotAuthorized:
                 message = "FNT Command authorization failed"
@@ -787,6 +1883,10 @@ class VFZSync:
                 logger.exception(message)
                 raise ZabbixAPIException(message)
 
+    def close(self):
+        if hasattr(self, "_vpoller"):
+            self._vpoller.close()
+
     def run_sync(self, mode, args=None):
         logger.info(f"{mode} sync started.")
         if mode in ["all", "vpoller-fnt"]:
@@ -805,21 +1905,78 @@ class VFZSync:
         #     # "cSdiDeleted": {"operator": "like", "value": "N"},
         #     }
         # }
+        streaming = vfzsync.CONFIG["vpoller"].get("streaming", False)
+        dryrun = debugtoolkit.DRYRUN
+        digests = None
+        config_lazy = vfzsync.CONFIG["command"].get("lazy_entities", {})
+        if config_lazy.get("enabled"):
+            digests = FNTEntityDigests(get_cache_path("fnt_vs_entities.json"), config_lazy.get("full_refresh", 86400))
         try:
-            vpoller_vms, vpoller_vms_indexed = get_vpoller_vms(self._vpoller, self._vcenters)
+            if not streaming:
+                vpoller_vms, vpoller_vms_indexed, vcenters_status = get_vpoller_vms(self._vpoller, self._vcenters)
 
             fnt_virtualservers, fnt_virtualservers_indexed = get_fnt_vs(
                 command=self._command,
                 indexes=("datasource", "cUuid"),
-                related_entities=True,
+                related_entities=digests is None,
                 datasources=self._vcenters
             )
-            if not vpoller_vms:
-                logger.warn(f"No VMs received from vpoller/vCenter, aborting sync.")
-                return False
 
-            sync_fnt_vs(self._command, vpoller_vms, fnt_virtualservers_indexed)
-            cleanup_fnt_vs(self._command, fnt_virtualservers, vpoller_vms_indexed)
+            streamed = None
+            if streaming:
+                # write to FNT while collecting, keep only the VM index for cleanup
+                vcenters_status = {}
+                vpoller_vms_indexed = {}
+
+                def vpoller_vms_stream():
+                    for vm in iter_vpoller_vms(self._vpoller, self._vcenters, vcenters_status):
+                        vpoller_vms_indexed[(vm["vc_host"], vm["config.instanceUuid"])] = True
+                        yield vm
+
+                streamed = sync_fnt_vs_stream(
+                    self._command, vpoller_vms_stream(), fnt_virtualservers_indexed, digests=digests, dryrun=dryrun
+                )
+                logger.info(f"Streamed {len(vpoller_vms_indexed)} VMs from vPoller.")
+                streamed.log_counts("FNT changeset (streamed)")
+                if not vpoller_vms_indexed:
+                    logger.warn(f"No VMs received from vpoller/vCenter, aborting sync.")
+                    return False
+                changeset = FNTChangeset()
+            else:
+                if not vpoller_vms:
+                    logger.warn(f"No VMs received from vpoller/vCenter, aborting sync.")
+                    return False
+                changeset = plan_fnt_vs_sync(self._command, vpoller_vms, fnt_virtualservers_indexed, digests=digests)
+
+            vcenters_incomplete = [
+                vc_host for vc_host in self._vcenters if not vcenters_status.get(vc_host, {}).get("complete")
+            ]
+            if vcenters_incomplete:
+                logger.warn(f"Incomplete data from vCenters {vcenters_incomplete}, skipping their cleanup.")
+            plan_fnt_vs_cleanup(
+                self._command,
+                fnt_virtualservers,
+                vpoller_vms_indexed,
+                skip_datasources=vcenters_incomplete,
+                digests=digests,
+                changeset=changeset,
+            )
+
+            changeset.log_counts("FNT changeset")
+            if dryrun or vfzsync.CONFIG["command"].get("changeset_dump", False):
+                if streamed is not None:
+                    streamed.merge(changeset)
+                    dump_fnt_changeset(streamed)
+                else:
+                    dump_fnt_changeset(changeset)
+            if dryrun:
+                logger.warning("Dry run, FNT changeset not applied.")
+                return
+            apply_fnt_changeset(self._command, changeset, digests=digests)
+
+            if digests is not None:
+                logger.info(f"Linked entities: {digests.hits} unchanged, {digests.misses} loaded.")
+                digests.save()
 
         except VFZException as e:
             logger.exception(str(e))
@@ -833,7 +1990,12 @@ class VFZSync:
         }
         index = ("id",)
         fnt_virtualservers, fnt_virtualservers_indexed = get_fnt_vs(
-            command=self._command, indexes=index, related_entities=False, restrictions=FNT_VS_FILTER_FNT_ZABBIX, datasources=vfzsync.CONFIG["vpoller"]["vc_hosts"]
+            command=self._command,
+            indexes=index,
+            related_entities=False,
+            restrictions=FNT_VS_FILTER_FNT_ZABBIX,
+            datasources=vfzsync.CONFIG["vpoller"]["vc_hosts"],
+            profile="zabbix",
         )
         #todo #bug? broken for initial sync?
         if not fnt_virtualservers:
@@ -844,18 +2006,27 @@ class VFZSync:
             self._zapi, vfzsync.CONFIG["zabbix"]["hostgroup"]
         )
         zabbix_hosts, zabbix_hosts_indexed_by_host = get_zabbix_hosts(self._zapi, zabbix_hostgroup_id)
+        dryrun = debugtoolkit.DRYRUN
 
         # cleanup
-        cleanup_zabbix_hosts(
-            self._zapi, zabbix_hosts=zabbix_hosts, fnt_virtualservers_indexed=fnt_virtualservers_indexed
+        deleted_hosts = cleanup_zabbix_hosts(
+            self._zapi,
+            zabbix_hosts=zabbix_hosts,
+            fnt_virtualservers_indexed=fnt_virtualservers_indexed,
+            dryrun=dryrun,
         )
 
-        zabbix_hosts, zabbix_hosts_indexed_by_host = get_zabbix_hosts(self._zapi, zabbix_hostgroup_id)
+        # drop the deleted hosts instead of fetching the group again
+        deleted_hostids = {host["hostid"] for host in deleted_hosts}
+        zabbix_hosts = [host for host in zabbix_hosts if host["hostid"] not in deleted_hostids]
+        for host in deleted_hosts:
+            zabbix_hosts_indexed_by_host.pop(host["host"], None)
 
         sync_zabbix_hosts(
             self._zapi,
             fnt_virtualservers=fnt_virtualservers,
             zabbix_hosts_indexed_by_host=zabbix_hosts_indexed_by_host,
+            dryrun=dryrun,
         )
 
     def get_fnt_vs_stats(self):
@@ -866,7 +2037,11 @@ class VFZSync:
         # }
         index = ("id",)
         fnt_virtualservers, fnt_virtualservers_indexed = get_fnt_vs(
-            command=self._command, indexes=index, related_entities=False, datasources=vfzsync.CONFIG["vpoller"]["vc_hosts"]
+            command=self._command,
+            indexes=index,
+            related_entities=False,
+            datasources=vfzsync.CONFIG["vpoller"]["vc_hosts"],
+            profile="stats",
         )
         stats_new = len(
             [
@@ -1005,12 +2180,19 @@ class VFZSync:
                 metric = ZabbixMetric(host, f"trigger.status[{tag}]", status_send)
                 host_senderset.append(metric)
 
-            for flag in FNT_ZABBIX_FLAG_TRIGGERS:
-                self._zapi.hostgroup.massupdate(
-                    groups=[{"groupid": zabbix_hostgroups[flag]}], hosts=hostids_by_flag[flag]
-                )
+            # one request for all flag groups
+            with ZabbixBatchAPI(self._zapi) as batch:
+                massupdates = [
+                    batch.hostgroup.massupdate(
+                        groups=[{"groupid": zabbix_hostgroups[flag]}], hosts=hostids_by_flag[flag]
+                    )
+                    for flag in FNT_ZABBIX_FLAG_TRIGGERS
+                ]
+            for massupdate in massupdates:
+                massupdate.result()
 
-        zabbix_send(host_senderset)
+        # a trapper value from outside is always sent, only recorded
+        zabbix_send(host_senderset, state=get_zabbix_sent_state(), force=mode == "trapper")
 
         if mode == "groupupdate":
             logger.debug(f"Send completed in {mode} mode.")
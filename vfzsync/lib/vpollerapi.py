@@ -1,5 +1,11 @@
+import asyncio
+import concurrent.futures
+import itertools
 import json
+import threading
 
+import zmq
+import zmq.asyncio
 from vpoller.client import VPollerClient
 
 from debugtoolkit.debugtoolkit import deflogger, deflogger_class, init_logger
@@ -10,17 +16,48 @@ class vPollerAPI:
     def deflogger_skip(self):
         pass
 
-    def __init__(self, vpoller_endpoint, vpoller_retries, vpoller_timeout):
+    def __init__(self, vpoller_endpoint, vpoller_retries, vpoller_timeout, vpoller_inflight=0):
         super().__init__()
-        self.client = VPollerClient(endpoint=vpoller_endpoint, retries=vpoller_retries, timeout=vpoller_timeout)
+        self.endpoint = vpoller_endpoint
+        self.retries = vpoller_retries
+        self.timeout = vpoller_timeout
+        self._local = threading.local()
+        # pipelined client shared by all threads
+        self._async_client = None
+        if vpoller_inflight:
+            self._async_client = vPollerAsyncClient(
+                endpoint=vpoller_endpoint, retries=vpoller_retries, timeout=vpoller_timeout, inflight=vpoller_inflight
+            )
+
+    @property
+    def client(self):
+        # zmq sockets are not thread-safe, keep one client per thread
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = VPollerClient(endpoint=self.endpoint, retries=self.retries, timeout=self.timeout)
+            self._local.client = client
+        # VPollerClient counts retries down and never resets them
+        client.retries = self.retries
+        return client
 
     def run(self, vc_host, method, name=None, key=None, properties=None):
         msg = {"method": method, "hostname": vc_host}
-        for prop in ['name', 'properties', 'key']:
-            if eval(prop) is not None:
-                msg[prop] = eval(prop)
+        for prop, value in (("name", name), ("properties", properties), ("key", key)):
+            if value is not None:
+                msg[prop] = value
 
-        response = json.loads(self.client.run(msg))
+        if self._async_client:
+            future = self._async_client.submit(msg)
+            # retries are bounded by the client, the margin covers queueing for the inflight limit
+            try:
+                response = future.result(timeout=self.timeout / 1000 * self.retries + 10)
+            except concurrent.futures.TimeoutError:
+                future.cancel()
+                raise vPollerException(f'Did not receive response for "{method}" in time')
+            except concurrent.futures.CancelledError:
+                raise vPollerException(f'Request "{method}" cancelled, vPoller client closed')
+        else:
+            response = json.loads(self.client.run(msg))
         if response["success"] == 0:
             result = response["result"]
             return result
@@ -28,6 +65,109 @@ class vPollerAPI:
             logger.error(f'Failed to execute method "{method}": {msg}')
             raise vPollerException(f'{response["msg"]}')
 
+    def close(self):
+        if self._async_client:
+            self._async_client.close()
+
+
+class vPollerAsyncClient:
+    """
+    Pipelined vPoller client: one persistent DEALER socket to the proxy,
+    up to `inflight` requests outstanding. Each request carries a
+    correlation ID as an envelope frame, which the proxy and the REP
+    workers route back unchanged with the reply.
+    The event loop runs in a background thread, `submit` is thread-safe.
+    """
+
+    def __init__(self, endpoint, retries, timeout, inflight):
+        super().__init__()
+        self.endpoint = endpoint
+        self.retries = retries
+        self.timeout = timeout  # ms, as VPollerClient
+        self.inflight = inflight
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._closed = False
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="vpoller-async", daemon=True)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._connect(), self._loop).result()
+
+    async def _connect(self):
+        self._zcontext = zmq.asyncio.Context()
+        self._socket = self._zcontext.socket(zmq.DEALER)
+        self._socket.setsockopt(zmq.LINGER, 0)
+        self._socket.connect(self.endpoint)
+        self._semaphore = asyncio.Semaphore(self.inflight)
+        self._reader = asyncio.ensure_future(self._read())
+
+    async def _read(self):
+        try:
+            while True:
+                frames = await self._socket.recv_multipart()
+                correlation_id, reply = frames[0], frames[-1]
+                future = self._pending.pop(correlation_id, None)
+                # replies to requests that already timed out are dropped
+                if future is not None and not future.done():
+                    future.set_result(reply)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception("vPoller reply reader failed.")
+            self._fail_pending(vPollerException(f"vPoller reply reader failed: {e}"))
+
+    def _fail_pending(self, exception):
+        pending, self._pending = self._pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(exception)
+
+    async def request(self, msg):
+        data = json.dumps(msg).encode()
+        async with self._semaphore:
+            for attempt in range(self.retries):
+                if self._reader.done():
+                    raise vPollerException(f'vPoller reply reader not running, "{msg["method"]}" not sent')
+                correlation_id = str(next(self._ids)).encode()
+                future = self._loop.create_future()
+                self._pending[correlation_id] = future
+                await self._socket.send_multipart([correlation_id, b"", data])
+                try:
+                    reply = await asyncio.wait_for(future, self.timeout / 1000)
+                except asyncio.TimeoutError:
+                    self._pending.pop(correlation_id, None)
+                    logger.warning(f'No response for "{msg["method"]}" in {self.timeout} ms, retrying.')
+                    continue
+                return json.loads(reply)
+
+        raise vPollerException(f'Did not receive response for "{msg["method"]}" after {self.retries} retries')
+
+    def submit(self, msg):
+        if self._closed:
+            raise vPollerException("vPoller client closed")
+        return asyncio.run_coroutine_threadsafe(self.request(msg), self._loop)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+
+        async def _close():
+            self._reader.cancel()
+            self._fail_pending(vPollerException("vPoller client closed"))
+            # requests still queued for the inflight limit or waiting for a reply
+            tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self._socket.close()
+            self._zcontext.term()
+
+        asyncio.run_coroutine_threadsafe(_close(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
 
 class vPollerException(Exception):
     """ vPoller Exception """
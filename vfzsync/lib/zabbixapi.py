@@ -1,6 +1,110 @@
+import itertools
+import json
+import threading
+import time
+from concurrent.futures import Future
+
+import requests
+import urllib3
+from pyzabbix.api import ZabbixAPIException
+
 from debugtoolkit.debugtoolkit import deflogger, dry_request, init_logger, measure
 
 
+class ZabbixBatchAPI:
+    """
+    JSON-RPC batch transport for a logged in ZabbixAPI: calls are queued
+    (batch.trigger.get(...) returns a Future) and sent as one batch array
+    on send() or when leaving the `with` block, which also closes the session.
+    """
+
+    def __init__(self, zapi, timeout=30):
+        super().__init__()
+        self.url = zapi.url
+        self.auth = zapi.auth
+        self.timeout = timeout
+        self._ids = itertools.count(1)
+        self._calls = []
+
+        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+        self.session = requests.Session()
+        self.session.verify = False
+        self.session.headers.update({"Content-Type": "application/json-rpc"})
+
+    def __getattr__(self, name):
+        return ZabbixBatchObject(name, self)
+
+    def call(self, method, *args, **kwargs):
+        if args and kwargs:
+            raise TypeError("Found both args and kwargs")
+        request = {"jsonrpc": "2.0", "method": method, "params": args or kwargs, "id": next(self._ids)}
+        if self.auth and method not in ("apiinfo.version", "user.login"):
+            request["auth"] = self.auth
+        future = Future()
+        self._calls.append((request, future))
+        return future
+
+    def send(self):
+        calls, self._calls = self._calls, []
+        if not calls:
+            return
+        logger.debug(f"Zabbix batch of {len(calls)} calls: {[request['method'] for request, future in calls]}")
+
+        try:
+            response = self.session.post(
+                self.url, data=json.dumps([request for request, future in calls]), timeout=self.timeout
+            )
+            responses = response.json()
+            # a malformed batch is answered with a single error object
+            if isinstance(responses, dict):
+                responses = [responses]
+        except (requests.RequestException, ValueError) as e:
+            for request, future in calls:
+                future.set_exception(ZabbixAPIException(f"Zabbix batch request failed: {e}"))
+            return
+
+        responses_by_id = {response.get("id"): response for response in responses}
+        for request, future in calls:
+            response = responses_by_id.get(request["id"])
+            if response is None:
+                error = next((response["error"] for response in responses if "error" in response), None)
+                future.set_exception(ZabbixAPIException(f"No response for {request['method']}: {error}"))
+            elif "error" in response:
+                error = response["error"].copy()
+                error.update({"json": str(request)})
+                future.set_exception(ZabbixAPIException(error))
+            else:
+                future.set_result(response["result"])
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            self.send()
+        finally:
+            self.close()
+        return False
+
+
+class ZabbixBatchObject:
+    """ batch.<group>.<method>(...), same call style as ZabbixAPI """
+
+    def __init__(self, group, batch):
+        super().__init__()
+        self.group = group
+        self.batch = batch
+
+    def __getattr__(self, name):
+        def fn(*args, **kwargs):
+            return self.batch.call(f"{self.group}.{name}", *args, **kwargs)
+
+        return fn
+
+
 def get_zabbix_hosts(zapi, zabbix_hostgroup_id):
     hosts = zapi.host.get(
         output=["name", "host", "status", "description"],
@@ -13,20 +117,62 @@ def get_zabbix_hosts(zapi, zabbix_hostgroup_id):
     return hosts, hosts_indexed_by_host
 
 
+class ZabbixIdCache:
+    """ name -> ID lookups shared by the whole process, kept for `ttl` seconds """
+
+    def __init__(self, ttl=300):
+        super().__init__()
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, zapi, kind, name, lookup):
+        key = (zapi.url, kind, name)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and time.time() - entry["cached"] < self.ttl:
+            return entry["id"]
+
+        object_id = None
+        try:
+            object_id = lookup()
+        finally:
+            # misses are not cached, the object may be created meanwhile
+            with self._lock:
+                if object_id is None:
+                    self._entries.pop(key, None)
+                else:
+                    self._entries[key] = {"id": object_id, "cached": time.time()}
+        return object_id
+
+    def invalidate(self, kind, name):
+        """ Drops the cached ID, e.g. after a call using it failed """
+        with self._lock:
+            for key in [key for key in self._entries if key[1:] == (kind, name)]:
+                del self._entries[key]
+
+
 def get_zabbix_hostgroupid_by_name(zapi, name):
-    groups = zapi.hostgroup.get(filter={"name": name})
-    if groups:
-        return int(groups[0]["groupid"])
-    else:
-        return None
+    def lookup():
+        groups = zapi.hostgroup.get(filter={"name": name})
+        if groups:
+            return int(groups[0]["groupid"])
+        else:
+            return None
+
+    return zabbix_id_cache.get(zapi, "hostgroup", name, lookup)
 
 
 def get_zabbix_templateid_by_name(zapi, name):
-    return int(zapi.template.get(filter={"host": name})[0]["templateid"])
+    return zabbix_id_cache.get(
+        zapi, "template", name, lambda: int(zapi.template.get(filter={"host": name})[0]["templateid"])
+    )
 
 
 def get_zabbix_proxyid_by_name(zapi, name):
-    return int(zapi.proxy.get(filter={"host": name})[0]["proxyid"])
+    return zabbix_id_cache.get(
+        zapi, "proxy", name, lambda: int(zapi.proxy.get(filter={"host": name})[0]["proxyid"])
+    )
 
 
 # def get_zabbix_host_triggers(zapi, hostids):
@@ -70,17 +216,8 @@ def get_zabbix_triggers(zapi, mode, groupids):
             # hostids=hostids,
             groupids=groupids,
             output=["status", "value"],
-            selectTags="extend",
-            # selectFunctions=["itemid"],
-            selectHosts=['host']
-        )
-
-    if mode == 'sync':
-        triggers = zapi.trigger.get(
-            # hostids=hostids,
-            groupids=groupids,
-            output=["status"],
-            selectTags="extend",
+            tags=[{"tag": "FNT_Flag"}],
+            selectTags=["tag", "value"],
             # selectFunctions=["itemid"],
             selectHosts=['host']
         )
@@ -112,23 +249,45 @@ def get_zabbix_triggers(zapi, mode, groupids):
 
 
 @deflogger
-def get_zabbix_items(zapi, groupids):
-    items = zapi.item.get(
-        # hostids=hostids,
+def get_zabbix_flag_index(zapi, groupids, flags):
+    """ hostid -> flag -> {"items": [...], "trigger": {...}}, only the flag applications and FNT_Flag triggers """
+    flags_indexed_by_hostids = {}
+
+    applications = zapi.application.get(
+        groupids=groupids,
+        filter={"name": flags},
+        output=["name", "hostid"],
+        selectItems=["itemid", "status"]
+    )
+    for application in applications:
+        host_flags = flags_indexed_by_hostids.setdefault(application["hostid"], {})
+        host_flag = host_flags.setdefault(application["name"], {"items": []})
+        host_flag["items"] += [{"itemid": item["itemid"], "status": item["status"]} for item in application["items"]]
+
+    triggers = zapi.trigger.get(
         groupids=groupids,
         output=["status"],
-        selectApplications="extend",
-        selectHosts=['hostid']
+        tags=[{"tag": "FNT_Flag"}],
+        selectTags=["tag", "value"],
+        selectHosts=["hostid"]
     )
+    for trigger in triggers:
+        flag = next((tag["value"] for tag in trigger["tags"] if tag["tag"] == "FNT_Flag"), None)
+        if flag not in flags:
+            continue
+        host_flags = flags_indexed_by_hostids.setdefault(trigger["hosts"][0]["hostid"], {})
+        host_flag = host_flags.setdefault(flag, {"items": []})
+        host_flag["trigger"] = {"triggerid": trigger["triggerid"], "status": trigger["status"]}
+
+    return flags_indexed_by_hostids
 
-    items_indexed_by_hostids = {}
-    for item in items:
-        hostid = item['hosts'][0]['hostid']
-        if not items_indexed_by_hostids.get(hostid):
-            items_indexed_by_hostids[hostid] = []
-        items_indexed_by_hostids[hostid].append(item)
 
-    return items, items_indexed_by_hostids
+def init_zabbix_id_cache(ttl):
+    """ Replaces the process wide cache, call once with the configured ttl """
+    global zabbix_id_cache
+    zabbix_id_cache = ZabbixIdCache(ttl)
+    return zabbix_id_cache
 
 
 logger = init_logger()
+zabbix_id_cache = ZabbixIdCache()
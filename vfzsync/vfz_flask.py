@@ -136,7 +136,10 @@ def run_action_do(resource, verb, mode, args=None):
 
     try:
         sync = VFZSync(init_mode=init_mode)
-        run_result = getattr(sync, f"run_{resource}")(mode, args)
+        try:
+            run_result = getattr(sync, f"run_{resource}")(mode, args)
+        finally:
+            sync.close()
         # import pdfkit
         # # pdf = pdfkit.from_string(run_result, False)
 